@@ -0,0 +1,39 @@
+from aiohttp import web
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import sys
+import webhook
+
+# only the SQLite event queue is touched here; eventd runs the events
+executor = ThreadPoolExecutor(max_workers = 2)
+
+async def get(request: web.Request) -> web.Response:
+    crc_token = request.query.get('crc_token')
+
+    if crc_token is not None and len(crc_token) == 48:
+        response = webhook.crc_response(crc_token)
+
+        return web.Response(text = json.dumps(response), status = 200, content_type = 'application/json')
+
+    return web.Response(text = '', status = 204, content_type = 'text/plain')
+
+async def post(request: web.Request) -> web.Response:
+    if 'X-Twitter-Webhooks-Signature' in request.headers:
+        data = await request.read()
+
+        if webhook.validate(request.headers.get('X-Twitter-Webhooks-Signature'), data):
+            body, status = await asyncio.get_running_loop().run_in_executor(executor, webhook.accept, json.loads(data))
+
+            return web.Response(text = body, status = status, content_type = 'text/plain')
+
+    return web.Response(text = '', status = 204, content_type = 'text/plain')
+
+webhook.init()
+
+application = web.Application()
+application.add_routes([web.get('/twitter', get), web.post('/twitter', post)])
+
+
+if __name__ == '__main__':
+    web.run_app(application, port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
@@ -1,275 +1,948 @@
-from typing import Any, Callable, List, Tuple, Union
-import sys
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+import glob
 import os
+import sys
+import random
+import re
 import sqlite3
+import threading
 import time
+import uuid
+import zlib
 import coinrpc
+import metrics
 from decimal import Decimal, ROUND_DOWN
-from config import WALLETDBPATH, MINCONF
+from config import WALLETDBPATH, WALLETSHARDS, MINCONF
+
+# a withdrawal batch is sent once this many addresses are pending or the
+# oldest request is this old, with at most WITHDRAWALOUTPUTS per sendmany
+WITHDRAWALCOUNT = 20
+WITHDRAWALAGE = 60 * 5
+WITHDRAWALOUTPUTS = 50
+
+# each shard keeps a pool of unassigned deposit addresses, topped up to
+# ADDRESSPOOLSIZE in one batched RPC once it drops below ADDRESSPOOLLOW
+ADDRESSPOOLLOW = 20
+ADDRESSPOOLSIZE = 100
+
+# RPC_INVALID_ADDRESS_OR_KEY, what listsinceblock answers for an unknown block
+BLOCKNOTFOUND = -5
+
+local = threading.local()
+
+# time writers spend waiting for the database lock in begin IMMEDIATE
+lock_stats_lock = threading.Lock()
+lock_stats = {'transactions': 0, 'wait_seconds': 0.0, 'retries': 0}
+
+# accounts are spread over WALLETSHARDS database files by a stable hash of
+# the account id, and each shard has its own writer lock. A tip between two
+# shards costs about 2.5x one within a shard, so more than one shard only
+# pays where bench/wallet_processes.py shows writers scaling with processes.
+def shard_of(account: str, shards: int = WALLETSHARDS) -> int:
+    return zlib.crc32(account.encode()) % shards
+
+def shard_path(shard: int, shards: int = WALLETSHARDS, path: str = WALLETDBPATH) -> str:
+    return path if shards == 1 else f'{path}.{shard}'
+
+def open_shard(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout = 10, isolation_level = None)
+    conn.execute('pragma journal_mode = WAL')
+
+    return conn
+
+def connection(shard: int) -> sqlite3.Connection:
+    conns = getattr(local, 'conns', None)
+
+    if conns is None:
+        conns = local.conns = {}
+
+    if shard not in conns:
+        conns[shard] = open_shard(shard_path(shard))
+
+    return conns[shard]
+
+def is_busy(err: sqlite3.OperationalError) -> bool:
+    if hasattr(err, 'sqlite_errorcode'):
+        return err.sqlite_errorcode & 0xff in {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+
+    return 'locked' in str(err) or 'busy' in str(err)
+
+def transaction(sql_func: Callable, read_only: bool, shard: int, *args: Any, **kwargs: Any) -> Any:
+    conn = connection(shard)
+
+    for i in range(5):
+        cursor = conn.cursor()
+        start = time.perf_counter()
+
+        try:
+            if read_only:
+                cursor.execute('pragma query_only = 1')
+                cursor.execute('begin DEFERRED')
+
+            else:
+                cursor.execute('begin IMMEDIATE')
+                waited = time.perf_counter() - start
+
+                with lock_stats_lock:
+                    lock_stats['transactions'] += 1
+                    lock_stats['wait_seconds'] += waited
+
+                metrics.observe('wallet_lock_wait_seconds', waited, function = sql_func.__name__)
+
+            r = sql_func(cursor, *args, **kwargs)
+            cursor.execute('commit')
+
+        except sqlite3.OperationalError as err:
+            if conn.in_transaction:
+                conn.rollback()
+
+            if not is_busy(err):
+                raise
+
+            print('Error:', err)
+            print('retry')
+
+            with lock_stats_lock:
+                lock_stats['retries'] += 1
+
+            metrics.inc('wallet_retries_total', function = sql_func.__name__)
 
+            e = err
+            time.sleep(random.uniform(0.05, 0.1) * 2 ** i)
+            continue
 
-# decorator
+        except:
+            if conn.in_transaction:
+                conn.rollback()
+
+            raise
+
+        finally:
+            if read_only:
+                cursor.execute('pragma query_only = 0')
+
+        metrics.observe('wallet_transaction_seconds', time.perf_counter() - start, function = sql_func.__name__)
+
+        return r
+
+    raise e
+
+
+# decorator, the decorated function takes the shard to run in as its first argument
 def sql_decorator(sql_func: Callable) -> Callable:
-    def new_sql_func(*args: Any, **kwargs: Any) -> Any:
-        with sqlite3.connect(WALLETDBPATH, timeout = 60, isolation_level = 'EXCLUSIVE') as conn:
-            for i in range(5):
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute('begin EXCLUSIVE')
+    def new_sql_func(shard: int, *args: Any, **kwargs: Any) -> Any:
+        return transaction(sql_func, False, shard, *args, **kwargs)
 
-                    r = sql_func(cursor, *args, **kwargs)
+    return new_sql_func
 
-                except Exception as err:
-                    print('Error:', err)
-                    print('retry')
-                    conn.rollback()
-                    e = err
-                    continue
+def read_sql_decorator(sql_func: Callable) -> Callable:
+    def new_sql_func(shard: int, *args: Any, **kwargs: Any) -> Any:
+        return transaction(sql_func, True, shard, *args, **kwargs)
 
-                else:
-                    conn.commit()
-                    return r
+    return new_sql_func
 
-            raise e
+# decorators for functions of one account, which run in that account's shard,
+# so callers outside this module never deal with shards
+def account_sql_decorator(sql_func: Callable) -> Callable:
+    def new_sql_func(account: str, *args: Any, **kwargs: Any) -> Any:
+        return transaction(sql_func, False, shard_of(account), account, *args, **kwargs)
 
     return new_sql_func
 
-@sql_decorator
-def init_db(cursor: sqlite3.Cursor) -> None:
-    cursor.execute('create table account_wallet(account text unique not null, balance real default 0.0 check(balance >= 0.0) not null)')
-    cursor.execute('create table account_address(account text not null, address text unique not null, time integer not null)')
-    cursor.execute('create table notified_tx(txid text not null, time integer not null, confirmed integer default 0 not null, account text, value real)')
-    cursor.execute('create table withdrawal_req(account text not null, address text not null, amount real check(amount >= 0.01) not null, completed integer default 0 not null)')
+def account_read_sql_decorator(sql_func: Callable) -> Callable:
+    def new_sql_func(account: str, *args: Any, **kwargs: Any) -> Any:
+        return transaction(sql_func, True, shard_of(account), account, *args, **kwargs)
+
+    return new_sql_func
+
+def create_tables(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists account_wallet(account text unique not null, balance real default 0.0 check(balance >= 0.0) not null)')
+    cursor.execute('create table if not exists account_address(account text not null, address text unique not null, time integer not null)')
+    cursor.execute('create table if not exists notified_tx(txid text not null, time integer not null, confirmed integer default 0 not null, account text, value real)')
+    cursor.execute('create table if not exists withdrawal_req(account text not null, address text not null, amount real check(amount >= 0.01) not null, completed integer default 0 not null)')
+
+def create_indexes(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create index if not exists account_address_account on account_address(account, time)')
+    cursor.execute('create index if not exists notified_tx_txid on notified_tx(txid)')
+    cursor.execute('create index if not exists notified_tx_pending on notified_tx(account, time) where confirmed == 0')
+    cursor.execute('create index if not exists notified_tx_pending_time on notified_tx(time) where confirmed == 0')
+    cursor.execute('create index if not exists withdrawal_req_pending on withdrawal_req(address) where completed == 0')
+
+def create_ledger(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('alter table account_wallet rename to old_account_wallet')
+    cursor.execute('alter table notified_tx rename to old_notified_tx')
+    cursor.execute('alter table withdrawal_req rename to old_withdrawal_req')
+
+    cursor.execute('create table account_wallet(account text unique not null, balance integer default 0 check(balance >= 0) not null)')
+    cursor.execute('create table notified_tx(txid text not null, time integer not null, confirmed integer default 0 not null, account text, value integer)')
+    cursor.execute('create table withdrawal_req(account text not null, address text not null, amount integer check(amount >= 1000000) not null, completed integer default 0 not null)')
+    cursor.execute('create table ledger(id integer primary key, account text not null, delta integer not null, kind text not null, ref text, time integer not null)')
+
+    cursor.execute('insert into account_wallet(rowid, account, balance) select rowid, account, cast(round(balance * 100000000) as integer) from old_account_wallet')
+    cursor.execute('insert into notified_tx(rowid, txid, time, confirmed, account, value) select rowid, txid, time, confirmed, account, cast(round(value * 100000000) as integer) from old_notified_tx')
+    cursor.execute('insert into withdrawal_req(rowid, account, address, amount, completed) select rowid, account, address, cast(round(amount * 100000000) as integer), completed from old_withdrawal_req')
+    cursor.execute('insert into ledger(account, delta, kind, time) select account, balance, ?, ? from account_wallet where balance != 0', ('migrate', int(time.time())))
+
+    cursor.execute('drop table old_account_wallet')
+    cursor.execute('drop table old_notified_tx')
+    cursor.execute('drop table old_withdrawal_req')
+
+    create_indexes(cursor)
+    cursor.execute('create index if not exists ledger_account on ledger(account)')
+
+def create_sync_state(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists sync_state(key text primary key, value text not null)')
+    cursor.execute('alter table notified_tx add column blockhash text')
+
+def create_withdrawal_batch(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('alter table withdrawal_req add column time integer default 0 not null')
+    cursor.execute('alter table withdrawal_req add column batch integer')
+    cursor.execute('alter table withdrawal_req add column txid text')
+    cursor.execute('create index if not exists withdrawal_req_batch on withdrawal_req(batch)')
+
+# a move to an account in another shard is debited and recorded in
+# transfer_out first, then credited once through transfer_in on the other
+# side, then marked done (state 1) in transfer_out
+def create_transfers(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists transfer_out(id text primary key, account text not null, to_account text not null, amount integer not null, state integer default 0 not null, time integer not null)')
+    cursor.execute('create table if not exists transfer_in(id text primary key, account text not null, from_account text not null, amount integer not null, time integer not null)')
+    cursor.execute('create index if not exists transfer_out_pending on transfer_out(time) where state == 0')
+
+def create_address_pool(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists address_pool(address text unique not null, time integer not null)')
+
+def create_account_indexes(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create index if not exists notified_tx_account on notified_tx(account)')
+    cursor.execute('create index if not exists withdrawal_req_account on withdrawal_req(account)')
+
+# the part of an orphaned deposit that had already been spent and could
+# not be taken back, held back when the deposit confirms again
+def create_reorg_debt(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('alter table notified_tx add column reorg_debt integer default 0 not null')
+
+# withdrawal and refund ledger rows refer to withdrawal_req ids, so ids of
+# rows that retention archived must never be handed out again
+def create_withdrawal_id(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('alter table withdrawal_req rename to old_withdrawal_req')
+    cursor.execute('create table withdrawal_req(id integer primary key autoincrement, account text not null, address text not null, amount integer check(amount >= 1000000) not null, completed integer default 0 not null, time integer default 0 not null, batch integer, txid text)')
+    cursor.execute('insert into withdrawal_req(id, account, address, amount, completed, time, batch, txid) select rowid, account, address, amount, completed, time, batch, txid from old_withdrawal_req')
+    cursor.execute('drop table old_withdrawal_req')
+
+    cursor.execute('create index if not exists withdrawal_req_pending on withdrawal_req(address) where completed == 0')
+    cursor.execute('create index if not exists withdrawal_req_batch on withdrawal_req(batch)')
+    cursor.execute('create index if not exists withdrawal_req_account on withdrawal_req(account)')
+
+    cursor.execute('delete from sqlite_sequence where name == \'withdrawal_req\'')
+    cursor.execute('insert into sqlite_sequence(name, seq) select \'withdrawal_req\', max((select coalesce(max(id), 0) from withdrawal_req), coalesce(max(cast(ref as integer)), 0)) from ledger where kind in (\'withdrawal\', \'refund\')')
+
+# a tip or withdrawal is recorded under the id of the event that asked for
+# it in the same transaction as the debit, so a replayed event can't repeat it
+def create_operations(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists operation(ref text primary key, account text not null, amount integer not null, time integer not null)')
+
+# retention leaves the txid of every deposit it archives here, so a notify
+# for it (e.g. kotod -rescan) isn't taken for a new deposit
+def create_archived_tx(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists archived_tx(txid text not null, account text, time integer not null)')
+    cursor.execute('create index if not exists archived_tx_txid on archived_tx(txid)')
+
+# migrations[i] upgrades a database from user_version i to i + 1
+migrations = [create_tables, create_indexes, create_ledger, create_sync_state, create_withdrawal_batch, create_transfers, create_address_pool, create_account_indexes, create_reorg_debt, create_withdrawal_id, create_operations, create_archived_tx]
+
+def upgrade(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('pragma user_version')
+    version = cursor.fetchone()[0]
+
+    for version in range(version, len(migrations)):
+        migrations[version](cursor)
+        cursor.execute(f'pragma user_version = {version + 1}')
+
+    return len(migrations)
 
 @sql_decorator
-def get_account_balance(cursor: sqlite3.Cursor, account: str) -> Tuple[Decimal, Decimal]:
-    cursor.execute('insert or ignore into account_wallet(account) values(?)', (account,))
+def migrate(cursor: sqlite3.Cursor) -> int:
+    return upgrade(cursor)
+
+# the wallet files next to WALLETDBPATH, in whatever layout they were written
+def wallet_files() -> Set[str]:
+    return {path for path in glob.glob(glob.escape(WALLETDBPATH) + '*') if path == WALLETDBPATH or re.fullmatch(r'\.\d+', path[len(WALLETDBPATH):])}
+
+# entry points call this once, importing the module touches no database.
+# Changing WALLETSHARDS without reshard would create empty shards and read
+# every balance as 0, so the files on disk have to match it.
+def init_db() -> None:
+    found = wallet_files()
+
+    if len(found) > 0 and found != {shard_path(shard) for shard in range(WALLETSHARDS)}:
+        raise RuntimeError(f'WALLETSHARDS is {WALLETSHARDS} but the wallet files are {", ".join(sorted(found))}, use reshard to change the number of shards')
+
+    for shard in range(WALLETSHARDS):
+        migrate(shard)
+
+# amounts are stored as integer units of 1e-8 KOTO
+COIN = 10 ** 8
+MAXUNITS = 2 ** 62
+
+def to_units(amount: Union[Decimal, float, str]) -> int:
+    return int((Decimal(str(amount)) * COIN).to_integral_value())
+
+def from_units(units: int) -> Decimal:
+    return Decimal(units).scaleb(-8)
+
+def journal(cursor: sqlite3.Cursor, account: str, delta: int, kind: str, ref: str) -> None:
+    cursor.execute('insert into ledger(account, delta, kind, ref, time) values(?, ?, ?, ?, ?)', (account, delta, kind, ref, int(time.time())))
+
+def credit(cursor: sqlite3.Cursor, account: str, delta: int, kind: str, ref: str) -> None:
+    cursor.execute('update account_wallet set balance = balance + ? where account == ?', (delta, account))
+    journal(cursor, account, delta, kind, ref)
+
+# the balance check and the debit are one statement, so nothing can slip in
+# between them and no balance has to be read first
+def debit(cursor: sqlite3.Cursor, account: str, amount: int) -> bool:
+    cursor.execute('update account_wallet set balance = balance - ? where account == ? and balance >= ?', (amount, account, amount))
+
+    return cursor.rowcount == 1
+
+# a second operation with the same ref fails on the primary key and rolls back
+def record_operation(cursor: sqlite3.Cursor, ref: Optional[str], account: str, amount: int) -> None:
+    if ref is not None:
+        cursor.execute('insert into operation(ref, account, amount, time) values(?, ?, ?, ?)', (ref, account, amount, int(time.time())))
+
+@account_read_sql_decorator
+def performed(cursor: sqlite3.Cursor, account: str, ref: str) -> Optional[int]:
+    cursor.execute('select amount from operation where ref == ? and account == ?', (ref, account))
+    amount = cursor.fetchone()
+
+    return amount[0] if amount is not None else None
 
+@account_read_sql_decorator
+def get_account_balance(cursor: sqlite3.Cursor, account: str) -> Tuple[Decimal, Decimal]:
     cursor.execute('select balance from account_wallet where account == ?', (account,))
-    balance = Decimal(str(cursor.fetchone()[0]))
+    balance = cursor.fetchone()
+    balance = balance[0] if balance is not None else 0
+
+    cursor.execute('select coalesce(sum(value), 0) from notified_tx where account == ? and confirmed == 0 and time > ?', (account, int(time.time()) - 60 * MINCONF * 10))
+    confirming_balance = cursor.fetchone()[0]
+
+    return (from_units(balance), from_units(confirming_balance))
+
+@read_sql_decorator
+def get_sync_state(cursor: sqlite3.Cursor, key: str) -> Optional[str]:
+    cursor.execute('select value from sync_state where key == ?', (key,))
+    value = cursor.fetchone()
 
-    cursor.execute('select value from notified_tx where account == ? and confirmed == 0 and time > ?', (account, int(time.time()) - 60 * MINCONF * 10))
-    values = [Decimal(str(r[0])) for r in cursor.fetchall()]
+    return value[0] if value is not None else None
 
-    confirming_balance = Decimal('0.0')
-    for value in values:
-        confirming_balance = confirming_balance + value
+@read_sql_decorator
+def verify_ledger(cursor: sqlite3.Cursor) -> List[Tuple[str, Decimal, Decimal]]:
+    cursor.execute('select account_wallet.account, account_wallet.balance, coalesce(sum(ledger.delta), 0) from account_wallet left join ledger on ledger.account == account_wallet.account group by account_wallet.account having account_wallet.balance != coalesce(sum(ledger.delta), 0)')
 
-    return (balance, confirming_balance)
+    return [(account, from_units(balance), from_units(total)) for account, balance, total in cursor]
 
 @sql_decorator
-def get_account_address(cursor: sqlite3.Cursor, account: str) -> str:
+def set_sync_state(cursor: sqlite3.Cursor, key: str, value: str) -> None:
+    cursor.execute('insert or replace into sync_state(key, value) values(?, ?)', (key, value))
+
+# address -> account for every handed out deposit address, loaded once and
+# then extended from each shard's account_address rows past the highest rowid seen
+address_index = {}
+address_index_rowid = [0] * WALLETSHARDS
+address_index_lock = threading.Lock()
+
+@read_sql_decorator
+def load_addresses(cursor: sqlite3.Cursor, rowid: int) -> List[Tuple[int, str, str]]:
+    cursor.execute('select rowid, address, account from account_address where rowid > ? order by rowid', (rowid,))
+
+    return cursor.fetchall()
+
+def find_accounts(addresses: Set[str]) -> Dict[str, str]:
+    with address_index_lock:
+        if not addresses <= address_index.keys():
+            for shard in range(WALLETSHARDS):
+                for rowid, address, account in load_addresses(shard, address_index_rowid[shard]):
+                    address_index[address] = account
+                    address_index_rowid[shard] = rowid
+
+        return {address: address_index[address] for address in addresses if address in address_index}
+
+@read_sql_decorator
+def address_pool_size(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('select count(*) from address_pool')
+
+    return cursor.fetchone()[0]
+
+@sql_decorator
+def add_to_address_pool(cursor: sqlite3.Cursor, addresses: List[str]) -> None:
+    cursor.executemany('insert or ignore into address_pool(address, time) values(?, ?)', [(address, int(time.time())) for address in addresses])
+
+# the RPC runs outside any transaction, so deposits never wait on the node
+def fill_address_pool(shard: int, low: int = ADDRESSPOOLLOW) -> int:
+    size = address_pool_size(shard)
+
+    if size >= low:
+        return 0
+
+    results = coinrpc.call_batch([('getnewaddress', ())] * (ADDRESSPOOLSIZE - size))
+    addresses = [result for result, error in results if error is None and result is not None]
+
+    add_to_address_pool(shard, addresses)
+
+    return len(addresses)
+
+def fill_address_pools() -> int:
+    return sum(fill_address_pool(shard) for shard in range(WALLETSHARDS))
+
+@account_sql_decorator
+def assign_address(cursor: sqlite3.Cursor, account: str) -> Optional[str]:
     cursor.execute('insert or ignore into account_wallet(account) values(?)', (account,))
 
     cursor.execute('select address from account_address where account == ? and time > ?', (account, int(time.time()) - 60 * 60 * 24 * 7))
     address = cursor.fetchone()
 
+    if address is not None:
+        return address[0]
+
+    cursor.execute('select rowid, address from address_pool order by rowid limit 1')
+    address = cursor.fetchone()
+
     if address is None:
-        address = coinrpc.call('getnewaddress')
-        cursor.execute('insert into account_address(account, address, time) values(?, ?, ?)', (account, address, int(time.time())))
+        return None
 
-    else:
-        address = address[0]
+    rowid, address = address
+
+    cursor.execute('delete from address_pool where rowid == ?', (rowid,))
+    cursor.execute('insert into account_address(account, address, time) values(?, ?, ?)', (account, address, int(time.time())))
+
+    with address_index_lock:
+        address_index[address] = account
 
     return address
 
+def get_account_address(account: str) -> str:
+    address = assign_address(account)
+
+    # the pool ran dry before walletd topped it up
+    if address is None:
+        fill_address_pool(shard_of(account), 1)
+        address = assign_address(account)
+
+    if address is None:
+        raise RuntimeError('no deposit address available')
+
+    return address
+
+def is_all(str_amount: str) -> bool:
+    return str_amount.lower() in {'all', '全額'}
+
 def is_amount(str_amount: str) -> bool:
-    if str_amount.lower() in {'all', '全額'}:
+    if is_all(str_amount):
         return True
 
+    # anything from 1e11 KOTO up is past MAXUNITS and would overflow quantize
     try:
-        Decimal(str_amount)
+        return Decimal(str_amount).is_finite() and Decimal(str_amount).adjusted() < 11
 
     except:
         return False
 
-    return True
+def get_amount(str_amount: str) -> Optional[int]:
+    if is_all(str_amount):
+        return None
+
+    return to_units(Decimal(str_amount).quantize(Decimal('1e-8'), rounding = ROUND_DOWN))
+
+@account_read_sql_decorator
+def get_balance(cursor: sqlite3.Cursor, account: str) -> int:
+    cursor.execute('select balance from account_wallet where account == ?', (account,))
+    balance = cursor.fetchone()
+
+    return balance[0] if balance is not None else 0
 
-def get_amount(str_amount: str, balance: Decimal) -> Decimal:
-    if str_amount.lower() in {'all', '全額'}:
-        return balance
+# credits recipients in the same shard directly and returns the transfers
+# still to be received by other shards, or None when the balance is short
+@account_sql_decorator
+def transfer(cursor: sqlite3.Cursor, from_account: str, to_accounts: List[str], amount: int, ref: Optional[str] = None) -> Optional[List[Tuple[str, str, str, int]]]:
+    if not debit(cursor, from_account, amount * len(to_accounts)):
+        return None
 
-    return Decimal(str_amount).quantize(Decimal('1e-8'), rounding = ROUND_DOWN)
+    record_operation(cursor, ref, from_account, amount)
+    transfers = []
+
+    for to_account in to_accounts:
+        journal(cursor, from_account, -amount, 'move', to_account)
+
+        if shard_of(to_account) != shard_of(from_account):
+            id = uuid.uuid4().hex
+            cursor.execute('insert into transfer_out(id, account, to_account, amount, time) values(?, ?, ?, ?, ?)', (id, from_account, to_account, amount, int(time.time())))
+            transfers.append((id, from_account, to_account, amount))
+            continue
+
+        cursor.execute('insert or ignore into account_wallet(account) values(?)', (to_account,))
+        credit(cursor, to_account, amount, 'move', from_account)
+
+    return transfers
 
 @sql_decorator
-def move(cursor: sqlite3.Cursor, from_account: str, to_account: str, str_amount: str) -> Union[str, Decimal]:
-    cursor.execute('insert or ignore into account_wallet(account) values(?)', (from_account,))
-    cursor.execute('insert or ignore into account_wallet(account) values(?)', (to_account,))
+def receive_transfers(cursor: sqlite3.Cursor, transfers: List[Tuple[str, str, str, int]]) -> None:
+    for id, from_account, to_account, amount in transfers:
+        cursor.execute('insert or ignore into transfer_in(id, account, from_account, amount, time) values(?, ?, ?, ?, ?)', (id, to_account, from_account, amount, int(time.time())))
 
-    if from_account == to_account:
+        if cursor.rowcount == 0:
+            continue
+
+        cursor.execute('insert or ignore into account_wallet(account) values(?)', (to_account,))
+        credit(cursor, to_account, amount, 'move', from_account)
+
+@sql_decorator
+def finish_transfers(cursor: sqlite3.Cursor, ids: List[str]) -> None:
+    cursor.executemany('update transfer_out set state = 1 where id == ?', [(id,) for id in ids])
+
+@read_sql_decorator
+def pending_transfers(cursor: sqlite3.Cursor, before: int) -> List[Tuple[str, str, str, int]]:
+    cursor.execute('select id, account, to_account, amount from transfer_out where state == 0 and time <= ?', (before,))
+
+    return cursor.fetchall()
+
+# receiving is idempotent, so a transfer interrupted at any point can simply be settled again
+def settle(transfers: List[Tuple[str, str, str, int]]) -> None:
+    for shard in {shard_of(transfer[2]) for transfer in transfers}:
+        receive_transfers(shard, [transfer for transfer in transfers if shard_of(transfer[2]) == shard])
+
+    for shard in {shard_of(transfer[1]) for transfer in transfers}:
+        finish_transfers(shard, [transfer[0] for transfer in transfers if shard_of(transfer[1]) == shard])
+
+def recover_transfers(age: int = 60) -> int:
+    count = 0
+
+    for shard in range(WALLETSHARDS):
+        transfers = pending_transfers(shard, int(time.time()) - age)
+
+        if len(transfers) > 0:
+            settle(transfers)
+            count = count + len(transfers)
+
+    return count
+
+def move(from_account: str, to_account: str, str_amount: str, ref: Optional[str] = None) -> Union[str, Decimal]:
+    return move_many(from_account, [to_account], str_amount, ref)
+
+# ref is the id of the event asking for the move, and a move already made
+# under it returns its amount again without moving anything
+def move_many(from_account: str, to_accounts: List[str], str_amount: str, ref: Optional[str] = None) -> Union[str, Decimal]:
+    done = performed(from_account, ref) if ref is not None else None
+
+    if done is not None:
+        return from_units(done)
+
+    if from_account in to_accounts:
         return 'self'
 
     if not is_amount(str_amount):
         return 'wrong'
 
-    cursor.execute('select balance from account_wallet where account == ?', (from_account,))
-    from_balance = Decimal(str(cursor.fetchone()[0]))
-
-    cursor.execute('select balance from account_wallet where account == ?', (to_account,))
-    to_balance = Decimal(str(cursor.fetchone()[0]))
+    amount = get_amount(str_amount)
 
-    amount = get_amount(str_amount, from_balance)
+    # 'all' is split evenly, and the balance may still change before the transfer
+    if amount is None:
+        amount = get_balance(from_account) // len(to_accounts)
 
     if amount <= 0:
         return 'few'
 
-    if from_balance < amount:
+    if amount * len(to_accounts) > MAXUNITS:
         return 'insufficient'
 
-    from_balance = from_balance - amount
-    to_balance = to_balance + amount
+    transfers = transfer(from_account, to_accounts, amount, ref)
 
-    cursor.execute('update account_wallet set balance = ? where account == ?', (float(from_balance), from_account))
-    cursor.execute('update account_wallet set balance = ? where account == ?', (float(to_balance), to_account))
+    if transfers is None:
+        return 'insufficient'
 
-    return amount
+    # the sender has already been debited, so a failure here is left to recover_transfers
+    try:
+        settle(transfers)
 
-@sql_decorator
-def add_withdrawal_request(cursor: sqlite3.Cursor, account: str, address: str, str_amount: str) -> Union[str, Decimal]:
-    cursor.execute('insert or ignore into account_wallet(account) values(?)', (account,))
+    except Exception as err:
+        print('Error:', err)
+        print(f'{len(transfers)} transfers from {from_account} are left to recover_transfers')
+
+    return from_units(amount)
+
+@account_sql_decorator
+def request_withdrawal(cursor: sqlite3.Cursor, account: str, address: str, amount: int, ref: Optional[str] = None) -> bool:
+    if not debit(cursor, account, amount):
+        return False
+
+    record_operation(cursor, ref, account, amount)
+
+    cursor.execute('insert into withdrawal_req(account, address, amount, time) values(?, ?, ?, ?)', (account, address, amount, int(time.time())))
+    journal(cursor, account, -amount, 'withdrawal', str(cursor.lastrowid))
+
+    return True
+
+def add_withdrawal_request(account: str, address: str, str_amount: str, ref: Optional[str] = None) -> Union[str, Decimal]:
+    done = performed(account, ref) if ref is not None else None
+
+    if done is not None:
+        return from_units(done)
 
     if not is_amount(str_amount):
         return 'wrong'
 
-    cursor.execute('select balance from account_wallet where account == ?', (account,))
-    balance = Decimal(str(cursor.fetchone()[0]))
+    amount = get_amount(str_amount)
 
-    amount = get_amount(str_amount, balance)
+    if amount is None:
+        amount = get_balance(account)
 
-    if amount < Decimal('0.01'):
+    if amount < to_units('0.01'):
         return 'few'
 
-    if balance < amount:
+    if amount > MAXUNITS or not request_withdrawal(account, address, amount, ref):
         return 'insufficient'
 
-    balance = balance - amount
+    return from_units(amount)
 
-    cursor.execute('update account_wallet set balance = ? where account == ?', (float(balance), account))
-    cursor.execute('insert into withdrawal_req(account, address, amount) values(?, ?, ?)', (account, address, float(amount)))
+@read_sql_decorator
+def is_notified(cursor: sqlite3.Cursor, txid: str) -> bool:
+    cursor.execute('select 1 from notified_tx where txid == ? union all select 1 from archived_tx where txid == ?', (txid, txid))
 
-    return amount
+    return cursor.fetchone() is not None
 
-def main() -> None:
-    @sql_decorator
-    def notify_tx(cursor: sqlite3.Cursor, txid: str) -> None:
-        cursor.execute('select * from notified_tx where txid == ?', (txid,))
+@sql_decorator
+def record_deposit(cursor: sqlite3.Cursor, txid: str, values: Dict[str, int]) -> None:
+    cursor.execute('select 1 from notified_tx where txid == ? union all select 1 from archived_tx where txid == ?', (txid, txid))
+
+    if cursor.fetchone() is not None:
+        return
+
+    for account, value in values.items():
+        cursor.execute('insert into notified_tx(txid, time, account, value) values(?, ?, ?, ?)', (txid, int(time.time()), account, value))
+
+def notify_tx(txid: str) -> None:
+    if any(is_notified(shard, txid) for shard in range(WALLETSHARDS)):
+        return
+
+    try:
+        result = coinrpc.call('gettransaction', txid)
+
+    except:
+        result = None
+
+    if result is None:
+        print('Error: gettransaction failed', txid)
+        return
+
+    details = [detail for detail in result.get('details', []) if detail.get('category') == 'receive']
+    accounts = find_accounts({detail.get('address') for detail in details})
+    values = {}
+
+    for detail in details:
+        account = accounts.get(detail.get('address'))
+
+        if account is None:
+            continue
+
+        values[account] = values.get(account, 0) + to_units(detail.get('amount'))
+
+    for shard in {shard_of(account) for account in values}:
+        record_deposit(shard, txid, {account: value for account, value in values.items() if shard_of(account) == shard})
+
+@sql_decorator
+def apply_sync(cursor: sqlite3.Cursor, transactions: List[Dict], accounts: Dict[str, str]) -> None:
+    deposits = {}
+
+    for tx in transactions:
+        if tx.get('category') != 'receive':
+            continue
+
+        account = accounts.get(tx.get('address'))
+
+        if account is None:
+            continue
+
+        deposit = deposits.setdefault(tx['txid'], {'confirmations': tx.get('confirmations', 0), 'blockhash': tx.get('blockhash'), 'values': {}})
+        deposit['values'][account] = deposit['values'].get(account, 0) + to_units(tx['amount'])
+
+    for txid, deposit in deposits.items():
+        cursor.execute('select 1 from archived_tx where txid == ?', (txid,))
 
         if cursor.fetchone() is not None:
+            continue
+
+        cursor.execute('select count(*) from notified_tx where txid == ? and account is not null', (txid,))
+
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('delete from notified_tx where txid == ?', (txid,))
+            cursor.executemany('insert into notified_tx(txid, time, account, value) values(?, ?, ?, ?)', [(txid, int(time.time()), account, value) for account, value in deposit['values'].items()])
+
+        confirmations = deposit['confirmations']
+
+        cursor.execute('select rowid, account, value, confirmed, reorg_debt from notified_tx where txid == ?', (txid,))
+
+        for rowid, account, value, confirmed, reorg_debt in cursor.fetchall():
+            if confirmed == 0 and confirmations >= MINCONF:
+                cursor.execute('insert or ignore into account_wallet(account) values(?)', (account,))
+                credit(cursor, account, value - reorg_debt, 'deposit', txid)
+                cursor.execute('update notified_tx set confirmed = 1, blockhash = ?, reorg_debt = 0 where rowid == ?', (deposit['blockhash'], rowid))
+
+            elif confirmed == 1 and confirmations < MINCONF:
+                cursor.execute('select balance from account_wallet where account == ?', (account,))
+                balance = cursor.fetchone()[0]
+
+                if balance < value:
+                    print(f'Error: {account} has already spent {from_units(value - balance)}KOTO of orphaned deposit {txid}, held back if it confirms again')
+
+                credit(cursor, account, -min(balance, value), 'reorg', txid)
+                cursor.execute('update notified_tx set confirmed = ?, blockhash = null, reorg_debt = ? where rowid == ?', (0 if confirmations >= 0 else -1, value - min(balance, value), rowid))
+
+            elif confirmed == 1:
+                cursor.execute('update notified_tx set blockhash = ? where rowid == ?', (deposit['blockhash'], rowid))
+
+# the cursor lives in shard 0 and only moves once every shard has applied
+# the transactions, which is safe to repeat after a crash in between
+# where checking starts when there is no last block, or the node no longer
+# knows it, e.g. after a reindex
+def recent_block() -> str:
+    return coinrpc.call('getblockhash', max(0, coinrpc.call('getblockcount') - MINCONF * 10))
+
+def check_tx() -> None:
+    lastblock = get_sync_state(0, 'lastblock')
+
+    if lastblock is None:
+        lastblock = recent_block()
+
+    [(result, error)] = coinrpc.call_batch([('listsinceblock', (lastblock, MINCONF))])
+
+    if error is not None and error.get('code') == BLOCKNOTFOUND:
+        print(f'Error: block {lastblock} not found, checking from {MINCONF * 10} blocks back')
+        lastblock = recent_block()
+        [(result, error)] = coinrpc.call_batch([('listsinceblock', (lastblock, MINCONF))])
+
+    if result is None:
+        print('Error: listsinceblock', lastblock, error)
+        return
+
+    transactions = result.get('transactions', [])
+    accounts = find_accounts({tx.get('address') for tx in transactions if tx.get('category') == 'receive'})
+
+    for shard in {shard_of(account) for account in accounts.values()}:
+        apply_sync(shard, transactions, {address: account for address, account in accounts.items() if shard_of(account) == shard})
+
+    set_sync_state(0, 'lastblock', result.get('lastblock'))
+
+@read_sql_decorator
+def withdrawal_due(cursor: sqlite3.Cursor) -> bool:
+    cursor.execute('select count(distinct address), min(time) from withdrawal_req where completed == 0')
+    count, oldest = cursor.fetchone()
+
+    return count >= WITHDRAWALCOUNT or (count > 0 and oldest <= int(time.time()) - WITHDRAWALAGE)
+
+@sql_decorator
+def claim_withdrawals(cursor: sqlite3.Cursor) -> Tuple[int, int, Dict[str, int]]:
+    cursor.execute('select address, sum(amount), min(id) from withdrawal_req where completed == 0 group by address order by min(id) limit ?', (WITHDRAWALOUTPUTS,))
+    rows = cursor.fetchall()
+    outputs = {address: amount for address, amount, first in rows}
+
+    if len(outputs) == 0:
+        return (0, 0, outputs)
+
+    cursor.execute('select coalesce(max(batch), 0) + 1 from withdrawal_req')
+    batch = cursor.fetchone()[0]
+
+    cursor.executemany('update withdrawal_req set completed = 2, batch = ? where address == ? and completed == 0', [(batch, address) for address in outputs])
+
+    return (batch, min(first for address, amount, first in rows), outputs)
+
+# the comment every sendmany carries, so its send can be found on the node
+# again. Batch numbers can come back once retention archives old batches,
+# withdrawal ids never do.
+def withdrawal_comment(shard: int, batch: int, first: int) -> str:
+    return f'withdrawal {shard}:{batch}:{first}'
+
+@sql_decorator
+def finish_withdrawals(cursor: sqlite3.Cursor, batch: int, txid: Optional[str]) -> None:
+    if txid is None:
+        cursor.execute('select id, account, amount from withdrawal_req where batch == ? and completed == 2', (batch,))
+
+        for id, account, amount in cursor.fetchall():
+            credit(cursor, account, amount, 'refund', str(id))
+
+        cursor.execute('update withdrawal_req set completed = -1 where batch == ? and completed == 2', (batch,))
+        return
+
+    cursor.execute('update withdrawal_req set completed = 1, txid = ? where batch == ? and completed == 2', (txid, batch))
+
+# each shard sends its own batches, so batch ids are per shard
+def exec_withdrawal() -> None:
+    for shard in range(WALLETSHARDS):
+        if withdrawal_due(shard):
+            exec_shard_withdrawal(shard)
+
+def exec_shard_withdrawal(shard: int) -> None:
+    while True:
+        batch, first, outputs = claim_withdrawals(shard)
+
+        if batch == 0:
             return
 
-        try:
-            result = coinrpc.call('decoderawtransaction', coinrpc.call('getrawtransaction', txid))
+        params = {address: float(from_units(amount)) for address, amount in outputs.items()}
 
-        except:
-            result = None
+        try:
+            txid = coinrpc.call('sendmany', '', params, MINCONF, withdrawal_comment(shard, batch, first), list(outputs), retries = 0)
 
-        if result is None:
-            cursor.execute('insert into notified_tx(txid, time, confirmed) values(?, ?, ?)', (txid, int(time.time()), -1))
+        except Exception as err:
+            # the node may or may not have sent it, so leave the batch in flight for resolve_withdrawals
+            print('Error:', err)
+            print(f'withdrawal batch {batch} of shard {shard} is left in flight, run resolve_withdrawals')
             return
 
-        account_found = False
+        finish_withdrawals(shard, batch, txid)
 
-        for vout in result.get('vout'):
-            for address in vout.get('scriptPubKey').get('addresses'):
-                cursor.execute('select account from account_address where address == ?', (address,))
-                account = cursor.fetchone()
+# batch -> (first withdrawal id, time of its oldest request)
+@read_sql_decorator
+def batches_in_flight(cursor: sqlite3.Cursor) -> Dict[int, Tuple[int, int]]:
+    cursor.execute('select batch, min(id), min(time) from withdrawal_req where completed == 2 group by batch')
 
-                if account is None:
-                    continue
+    return {batch: (first, oldest) for batch, first, oldest in cursor.fetchall()}
 
-                account_found = True
+# the node's sends since the oldest request, as comment -> txid
+def node_sends(since: int) -> Dict[str, str]:
+    sends = {}
+    skip = 0
 
-                account = account[0]
-                value = vout.get('value')
+    while True:
+        page = coinrpc.call('listtransactions', '*', 1000, skip)
 
-                cursor.execute('insert into notified_tx(txid, time, account, value) values(?, ?, ?, ?)', (txid, int(time.time()), account, value))
-                continue
+        for tx in page:
+            if tx.get('category') == 'send' and tx.get('confirmations', 0) >= 0 and tx.get('time', 0) >= since and tx.get('comment'):
+                sends[tx['comment']] = tx['txid']
 
-        if not account_found:
-            cursor.execute('insert into notified_tx(txid, time, confirmed) values(?, ?, ?)', (txid, int(time.time()), 2))
+        if len(page) < 1000 or all(tx.get('time', 0) < since for tx in page):
+            return sends
 
-    @sql_decorator
-    def check_tx(cursor: sqlite3.Cursor) -> None:
-        cursor.execute('select txid from notified_tx where confirmed == 0 and time > ?', (int(time.time()) - 60 * MINCONF * 10,))
+        skip = skip + 1000
 
-        txids = {r[0] for r in cursor.fetchall()}
+# a batch left in flight by a failed sendmany is finished with the node's
+# send that carries its comment. A batch the node has no send for may still
+# have been sent, or be sent later, so it stays in flight for an operator to
+# check and refund_withdrawal.
+def resolve_withdrawals() -> Tuple[int, List[Tuple[int, int]]]:
+    batches = {(shard, batch): (withdrawal_comment(shard, batch, first), oldest) for shard in range(WALLETSHARDS) for batch, (first, oldest) in batches_in_flight(shard).items()}
 
-        if len(txids) == 0:
-            return
+    if len(batches) == 0:
+        return (0, [])
 
-        for txid in txids:
-            result = coinrpc.call('gettransaction', txid)
+    sends = node_sends(min(since for comment, since in batches.values()))
+    left = []
 
-            if result is None:
-                cursor.execute('update notified_tx set confirmed = -1 where txid == ?', (txid,))
-                continue
+    for (shard, batch), (comment, since) in sorted(batches.items()):
+        if comment in sends:
+            finish_withdrawals(shard, batch, sends[comment])
 
-            confirmations = result.get('confirmations')
+        else:
+            left.append((shard, batch))
 
-            if confirmations < MINCONF:
-                continue
+    return (len(batches) - len(left), left)
 
-            cursor.execute('select account, value from notified_tx where txid == ?', (txid,))
+# tables copied by reshard, with the column that decides the new shard
+RESHARDTABLES = [
+    ('account_wallet', 'account', ['account', 'balance']),
+    ('account_address', 'account', ['account', 'address', 'time']),
+    ('notified_tx', 'account', ['txid', 'time', 'confirmed', 'account', 'value', 'blockhash', 'reorg_debt']),
+    ('withdrawal_req', 'account', ['account', 'address', 'amount', 'completed', 'time', 'batch', 'txid']),
+    ('ledger', 'account', ['account', 'delta', 'kind', 'ref', 'time']),
+    ('address_pool', 'address', ['address', 'time']),
+    ('operation', 'account', ['ref', 'account', 'amount', 'time']),
+    ('archived_tx', 'account', ['txid', 'account', 'time']),
+]
 
-            for account, value in cursor.fetchall():
-                cursor.execute('select balance from account_wallet where account == ?', (account,))
+# offline: the bot and walletd must be stopped, and the new files are
+# written next to path so the old ones stay untouched until config is switched
+def reshard(shards: int, path: str) -> None:
+    recover_transfers(0)
 
-                balance = Decimal(str(cursor.fetchone()[0]))
-                value = Decimal(str(value))
+    for shard in range(WALLETSHARDS):
+        if len(pending_transfers(shard, int(time.time()))) > 0:
+            print(f'Error: shard {shard} still has unsettled transfers')
+            return
 
-                balance = balance + value
-                cursor.execute('update account_wallet set balance = ? where account == ?', (float(balance), account))
+        cursor = connection(shard).execute('select count(*) from withdrawal_req where completed == 2')
 
-            cursor.execute('update notified_tx set confirmed = 1 where txid == ?', (txid,))
+        if cursor.fetchone()[0] > 0:
+            print(f'Error: shard {shard} has a withdrawal batch in flight, run resolve_withdrawals first')
+            return
 
-    @sql_decorator
-    def exec_withdrawal(cursor: sqlite3.Cursor) -> None:
-        cursor.execute('select address from withdrawal_req where completed == 0')
-        addresses = {r[0] for r in cursor.fetchall()}
+    paths = [shard_path(shard, shards, path) for shard in range(shards)]
 
-        if len(addresses) == 0:
+    for new_path in paths:
+        if os.path.exists(new_path):
+            print(f'Error: {new_path} already exists')
             return
 
-        params = {}
+    conns = [open_shard(new_path) for new_path in paths]
 
-        for address in addresses:
-            cursor.execute('select amount from withdrawal_req where address == ? and completed == 0', (address,))
-            req_amounts = [Decimal(str(r[0])) for r in cursor.fetchall()]
+    for conn in conns:
+        conn.execute('begin IMMEDIATE')
+        upgrade(conn.cursor())
 
-            amount = Decimal('0.0')
-            for req_amount in req_amounts:
-                amount = amount + req_amount
+    # new ids start above every id the old shards handed out, archived ones included
+    start = max(connection(shard).execute('select seq from sqlite_sequence where name == \'withdrawal_req\'').fetchone()[0] for shard in range(WALLETSHARDS))
 
-            params[address] = float(amount)
+    for conn in conns:
+        conn.execute('update sqlite_sequence set seq = ? where name == \'withdrawal_req\'', (start,))
 
-        try:
-            txid = coinrpc.call('sendmany', '', params, MINCONF, '', list(addresses))
+    totals = [0, 0]
 
-        except:
-            txid = None
+    for shard in range(WALLETSHARDS):
+        conn = connection(shard)
+        totals[0] = totals[0] + conn.execute('select coalesce(sum(balance), 0) from account_wallet').fetchone()[0]
 
-        if txid is None:
-            cursor.execute('select account, value from withdrawal_req where completed == 0')
-            for req in cursor.fetchall():
-                account = req[0]
-                value = Decimal(str(req[1]))
+        # withdrawal and refund ledger rows refer to withdrawal_req ids, which change
+        withdrawals = {}
 
-                cursor.execute('select balance from account_wallet where account == ?', (account,))
-                balance = Decimal(str(cursor.fetchone()[0]))
+        for table, key, columns in RESHARDTABLES:
+            insert = f'insert into {table}({", ".join(columns)}) values({", ".join("?" * len(columns))})'
+            index = columns.index(key)
 
-                balance = balance + value
+            for row in conn.execute(f'select rowid, {", ".join(columns)} from {table} order by rowid'):
+                rowid, row = row[0], row[1:]
+                new_shard = shard_of(row[index], shards) if row[index] is not None else 0
 
-                cursor.execute('update account_wallet set balance = ? where account == ?', (float(balance), account))
+                if table == 'ledger' and row[2] in {'withdrawal', 'refund'}:
+                    row = row[:3] + (withdrawals.get(row[3], row[3]),) + row[4:]
 
-            cursor.execute('update withdrawal_req set completed = -1 where completed == 0')
-            return
+                cursor = conns[new_shard].execute(insert, row)
+
+                if table == 'withdrawal_req':
+                    withdrawals[str(rowid)] = str(cursor.lastrowid)
+
+    for key, value in connection(0).execute('select key, value from sync_state'):
+        conns[0].execute('insert into sync_state(key, value) values(?, ?)', (key, value))
 
-        cursor.execute('update withdrawal_req set completed = 1 where completed == 0')
+    for conn in conns:
+        totals[1] = totals[1] + conn.execute('select coalesce(sum(balance), 0) from account_wallet').fetchone()[0]
 
+    if totals[0] != totals[1]:
+        print(f'Error: total balance {from_units(totals[0])} != {from_units(totals[1])} after resharding')
+
+        for conn in conns:
+            conn.rollback()
+
+        return
+
+    for conn in conns:
+        conn.commit()
+        conn.close()
+
+    print(f'{WALLETSHARDS} shards resharded into {shards}, total balance {from_units(totals[1])}KOTO')
+    print(f'set WALLETDBPATH = {path!r} and WALLETSHARDS = {shards} to use them')
+
+def main() -> None:
     if len(sys.argv) < 2:
         print('Argument is missing.')
         return
 
+    init_db()
+
     if sys.argv[1] == 'notify_tx':
         if len(sys.argv) < 3:
             print('Argument is missing.')
@@ -286,9 +959,46 @@ def main() -> None:
         exec_withdrawal()
         return
 
+    if sys.argv[1] == 'resolve_withdrawals':
+        sent, left = resolve_withdrawals()
+        print(f'{sent} withdrawal batches found sent')
 
-if not os.path.exists(WALLETDBPATH):
-    init_db()
+        for shard, batch in left:
+            print(f'shard {shard} batch {batch}: no send on the node, check it and run refund_withdrawal {shard} {batch} once it surely was not sent')
+
+        return
+
+    # only for a batch the operator has made sure the node never sent
+    if sys.argv[1] == 'refund_withdrawal':
+        if len(sys.argv) < 4:
+            print('Argument is missing.')
+            return
+
+        finish_withdrawals(int(sys.argv[2]), int(sys.argv[3]), None)
+        return
+
+    if sys.argv[1] == 'verify_ledger':
+        for shard in range(WALLETSHARDS):
+            for account, balance, total in verify_ledger(shard):
+                print(f'{account}: balance {balance} != ledger {total}')
+
+        return
+
+    if sys.argv[1] == 'fill_address_pool':
+        print(f'{fill_address_pools()} addresses added')
+        return
+
+    if sys.argv[1] == 'recover_transfers':
+        print(f'{recover_transfers(0)} transfers settled')
+        return
+
+    if sys.argv[1] == 'reshard':
+        if len(sys.argv) < 4:
+            print('Argument is missing.')
+            return
+
+        reshard(int(sys.argv[2]), sys.argv[3])
+        return
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+# Measures tipbot.get_command throughput over a corpus of mention texts.
+#
+#     python bench/command_parser.py [seconds]
+
+from typing import List
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tipbot
+from config import BOTSCREENNAME
+
+TEMPLATES = [
+    '@{bot} tip @akarinSS 39 Thank you!',
+    '@{bot} tip 510 @akarinSS kotoooooo!',
+    '@{bot} 投げ銭 @koto_fan 1.5 ありがとう〜',
+    '@{bot}　送金　@someone　全額',
+    '@{bot} tip @alice @bob @carol 0.1 rain!',
+    '@{bot} balance',
+    '@{bot} 残高確認お願いします',
+    '@{bot}\n入金',
+    '@{bot} withdraw k1HfGvF2W3RT6atwn1eFncsqbrFuDDSXJb9 50',
+    '@{bot} 出金 all k1HfGvF2W3RT6atwn1eFncsqbrFuDDSXJb9',
+    '@{bot} follow me',
+    '@{bot} フォローして！',
+    '@{bot} help',
+    '@friend @{bot} これってどうやって使うの？',
+    '@{bot} @{bot} tip @akarinSS 1',
+    'RT @akarinSS: @{bot} tip @someone 100',
+    '@akarinSS おはようございます！今日もKotoを掘っています',
+    '@someone @another 昨日のライブ最高だった #koto',
+    '@{bot} すごい！ Koto最高 ' + 'とても長い文章' * 10,
+]
+
+def corpus(size: int) -> List[str]:
+    random.seed(0)
+
+    return [random.choice(TEMPLATES).format(bot = BOTSCREENNAME) for i in range(size)]
+
+def main() -> None:
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    texts = corpus(10000)
+
+    count = 0
+    start = time.perf_counter()
+
+    while time.perf_counter() - start < seconds:
+        for text in texts:
+            tipbot.get_command(text)
+
+        count = count + len(texts)
+
+    elapsed = time.perf_counter() - start
+
+    print(f'{count} texts in {elapsed:.2f}s: {count / elapsed:,.0f} texts/s, {elapsed / count * 1e6:.2f} us/text')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# A local stand-in for kotod's JSON-RPC interface, answering the calls made
+# by accountwallet and tipbot with plausible results after a fixed latency.
+
+from typing import Any, Dict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import string
+import threading
+import time
+
+def random_hex(length: int = 64) -> str:
+    return ''.join(random.choice('0123456789abcdef') for i in range(length))
+
+def random_address() -> str:
+    return 'k1' + ''.join(random.choice(string.ascii_letters + string.digits) for i in range(33))
+
+METHODS = {
+    'getnewaddress': lambda *params: random_address(),
+    'validateaddress': lambda address, *params: {'isvalid': address.startswith('k') and len(address) == 35, 'address': address},
+    'gettransaction': lambda txid, *params: {'txid': txid, 'confirmations': 0, 'details': []},
+    'getrawtransaction': lambda txid, verbose = 0, *params: {'txid': txid, 'vout': []} if verbose else '00',
+    'decoderawtransaction': lambda hex, *params: {'txid': random_hex(), 'vout': []},
+    'sendmany': lambda *params: random_hex(),
+    'listsinceblock': lambda *params: {'transactions': [], 'lastblock': random_hex()},
+    'getblockcount': lambda *params: 100000,
+    'getblockhash': lambda height, *params: random_hex(),
+    'getbalance': lambda *params: 0.0,
+}
+
+class Handler(BaseHTTPRequestHandler):
+    server: 'FakeKotod'
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers['content-length'])))
+
+        time.sleep(self.server.latency)
+
+        if isinstance(body, list):
+            response = [self.server.dispatch(r) for r in body]
+
+        else:
+            response = self.server.dispatch(body)
+
+        data = json.dumps(response).encode()
+
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+class FakeKotod(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        super().__init__(('localhost', port), Handler)
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def dispatch(self, request: Dict) -> Dict:
+        method = request.get('method')
+
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method not in METHODS:
+            return {'id': request.get('id'), 'result': None, 'error': {'code': -32601, 'message': 'Method not found'}}
+
+        return {'id': request.get('id'), 'result': METHODS[method](*request.get('params', [])), 'error': None}
+
+    def start(self) -> 'FakeKotod':
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+
+        return self
+
+
+if __name__ == '__main__':
+    server = FakeKotod(8432)
+    print('fake kotod on port', server.server_address[1])
+    server.serve_forever()
@@ -0,0 +1,120 @@
+# A local stand-in for the Twitter API endpoints tipkotone uses. Replies are
+# recorded with their arrival time so a driver can measure end-to-end latency.
+
+from typing import Any, Dict, List, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import threading
+import time
+import zlib
+
+def user_id(screen_name: str) -> str:
+    return str(zlib.crc32(screen_name.lower().encode()))
+
+def user(screen_name: str) -> Dict:
+    return {'id_str': user_id(screen_name), 'screen_name': screen_name, 'name': screen_name.capitalize()}
+
+class Handler(BaseHTTPRequestHandler):
+    server: 'FakeTwitter'
+
+    def reply(self, response: Any, status: int = 200) -> None:
+        data = json.dumps(response).encode()
+
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        self.send_header('x-rate-limit-remaining', '100000')
+        self.send_header('x-rate-limit-reset', str(int(time.time()) + 900))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def params(self) -> Dict[str, str]:
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('content-length', 0))).decode()
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if self.headers.get('content-type', '').startswith('application/json'):
+            params['json'] = json.loads(body)
+
+        else:
+            params.update({key: values[0] for key, values in parse_qs(body).items()})
+
+        return params
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        path = urlparse(self.path).path
+        params = self.params()
+
+        if path.endswith('/users/show.json'):
+            self.server.count('users/show')
+            self.reply(user(params['screen_name']))
+            return
+
+        self.reply({'errors': [{'code': 34}]}, 404)
+
+    def do_POST(self) -> None:
+        time.sleep(self.server.latency)
+        path = urlparse(self.path).path
+        params = self.params()
+
+        if path.endswith('/statuses/update.json'):
+            self.server.record('statuses/update', params['in_reply_to_status_id'])
+            self.reply({'id_str': str(time.time_ns())})
+            return
+
+        if path.endswith('/direct_messages/events/new.json'):
+            self.server.record('direct_messages/events/new', params['json']['event']['message_create']['target']['recipient_id'])
+            self.reply({'event': {}})
+            return
+
+        if path.endswith('/users/lookup.json'):
+            self.server.count('users/lookup')
+            self.reply([user(screen_name) for screen_name in params['screen_name'].split(',')])
+            return
+
+        if path.endswith('/friendships/create.json'):
+            self.server.count('friendships/create')
+            self.reply({})
+            return
+
+        self.reply({'errors': [{'code': 34}]}, 404)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+class FakeTwitter(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        super().__init__(('localhost', port), Handler)
+        self.latency = latency
+        self.calls = {}
+        self.replies: List[Tuple[str, str, float]] = []
+        self.lock = threading.Lock()
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def record(self, endpoint: str, key: str) -> None:
+        self.count(endpoint)
+
+        with self.lock:
+            self.replies.append((endpoint, key, time.time()))
+
+    @property
+    def url(self) -> str:
+        return f'http://localhost:{self.server_address[1]}/1.1'
+
+    def start(self) -> 'FakeTwitter':
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+
+        return self
+
+
+if __name__ == '__main__':
+    server = FakeTwitter(8433)
+    print('fake twitter on', server.url)
+    server.serve_forever()
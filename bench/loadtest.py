@@ -0,0 +1,184 @@
+# End-to-end load test: runs aaapi and eventd against fake kotod and Twitter servers in a
+# scratch directory and reports throughput, reply latency and SQLite lock wait
+# for each concurrency level.
+#
+#     python bench/loadtest.py --levels 1,4,16 --events 2000
+
+from typing import Dict, List
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values: List[float], p: float) -> float:
+    if len(values) == 0:
+        return float('nan')
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run_level(args: argparse.Namespace) -> Dict:
+    from fakekotod import FakeKotod
+    from faketwitter import FakeTwitter
+    import config
+
+    kotod = FakeKotod(latency = args.rpc_latency).start()
+    twitter_api = FakeTwitter(latency = args.twitter_latency).start()
+
+    directory = tempfile.mkdtemp()
+    config.WALLETDBPATH = os.path.join(directory, 'wallet.db')
+    config.EVENTDBPATH = os.path.join(directory, 'event.db')
+    config.USERCACHEPATH = None
+    config.METRICSDIR = None
+    config.RPCPORT = kotod.server_address[1]
+    config.WORKERS = args.level
+    config.QUEUESIZE = args.events * 2
+
+    import accountwallet as aw
+    import twitter
+    twitter.API = twitter_api.url
+
+    import aaapi
+    import eventd
+    import eventqueue
+    import webhook
+
+    # measure throughput, not the per-user rate limit
+    webhook.USERBURST = args.events
+    import outbox
+    import webhooks
+
+    @aw.sql_decorator
+    def seed(cursor, accounts: List[str], units: int) -> None:
+        for account in accounts:
+            cursor.execute('insert or ignore into account_wallet(account) values(?)', (account,))
+            aw.credit(cursor, account, units, 'deposit', 'loadtest')
+
+    aw.init_db()
+    accounts = ['twitter-' + webhooks.sender(i)['id_str'] for i in range(args.users)]
+
+    for shard in range(config.WALLETSHARDS):
+        seed(shard, [account for account in accounts if aw.shard_of(account) == shard], aw.to_units('1000'))
+
+    # walletd keeps the deposit address pools topped up in production
+    aw.fill_address_pools()
+    eventd.start()
+
+    @eventqueue.sql_decorator
+    def unfinished(cursor) -> int:
+        cursor.execute('select count(*) from event where status in (0, 1)')
+
+        return cursor.fetchone()[0]
+
+    deliveries = iter(list(webhooks.payloads(args.events, args.users, dm_ratio = args.dm_ratio)))
+    deliveries_lock = threading.Lock()
+    sent = {}
+    statuses = {}
+
+    def post() -> None:
+        client = aaapi.application.test_client()
+
+        while True:
+            with deliveries_lock:
+                delivery = next(deliveries, None)
+
+            if delivery is None:
+                return
+
+            body, headers, key = delivery
+            start = time.time()
+            status = client.post('/twitter', data = body, headers = headers).status_code
+
+            with deliveries_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+                if key is not None:
+                    sent.setdefault(key, []).append(start)
+
+    start = time.time()
+    posters = [threading.Thread(target = post) for i in range(args.posters or args.level)]
+
+    for poster in posters:
+        poster.start()
+
+    for poster in posters:
+        poster.join()
+
+    accepted = time.time()
+
+    while (unfinished() > 0 or outbox.depth() > 0) and time.time() - start < args.timeout:
+        time.sleep(0.05)
+
+    while len(twitter_api.replies) < sum(len(v) for v in sent.values()) and time.time() - start < args.timeout:
+        time.sleep(0.05)
+
+    end = time.time()
+
+    latencies = []
+
+    for endpoint, key, arrived in twitter_api.replies:
+        if sent.get((endpoint, key)):
+            latencies.append(arrived - sent[(endpoint, key)].pop(0))
+
+    return {
+        'level': args.level,
+        'events': args.events,
+        'statuses': statuses,
+        'events_per_sec': args.events / (end - start),
+        'accept_per_sec': args.events / (accepted - start),
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'replies': len(twitter_api.replies),
+        'lock_wait': aw.lock_stats['wait_seconds'],
+        'lock_wait_per_tx': aw.lock_stats['wait_seconds'] / max(1, aw.lock_stats['transactions']),
+        'retries': aw.lock_stats['retries'],
+        'rpc_calls': kotod.calls,
+        'twitter_calls': twitter_api.calls,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', default = '1,4,16', help = 'comma separated worker counts')
+    parser.add_argument('--level', type = int, help = argparse.SUPPRESS)
+    parser.add_argument('--posters', type = int, default = 0, help = 'concurrent webhook posters (default: level)')
+    parser.add_argument('--events', type = int, default = 1000)
+    parser.add_argument('--users', type = int, default = 200)
+    parser.add_argument('--dm-ratio', type = float, default = 0.2)
+    parser.add_argument('--rpc-latency', type = float, default = 0.002)
+    parser.add_argument('--twitter-latency', type = float, default = 0.02)
+    parser.add_argument('--timeout', type = float, default = 600)
+    parser.add_argument('--json', action = 'store_true', help = 'print raw results')
+    args = parser.parse_args()
+
+    if args.level is not None:
+        print(json.dumps(run_level(args)))
+        return
+
+    # each level runs in a fresh interpreter so module level state starts clean
+    results = []
+
+    for level in [int(level) for level in args.levels.split(',')]:
+        command = [sys.executable, os.path.abspath(__file__), '--level', str(level), '--posters', str(args.posters), '--events', str(args.events), '--users', str(args.users), '--dm-ratio', str(args.dm_ratio), '--rpc-latency', str(args.rpc_latency), '--twitter-latency', str(args.twitter_latency), '--timeout', str(args.timeout)]
+        output = subprocess.run(command, capture_output = True, text = True, check = True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent = 2))
+        return
+
+    print(f'{"workers":>8}{"events/s":>10}{"accept/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"lock wait s":>13}{"wait/tx ms":>12}{"retries":>9}')
+
+    for r in results:
+        print(f'{r["level"]:>8}{r["events_per_sec"]:>10.1f}{r["accept_per_sec"]:>10.1f}{r["p50"] * 1000:>9.1f}{r["p99"] * 1000:>9.1f}{r["lock_wait"]:>13.3f}{r["lock_wait_per_tx"] * 1000:>12.3f}{r["retries"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Cold-start cost of the event path: a fresh interpreter imports tipbot
+# under -X importtime and handles one mention that is not a command. Fails
+# when the median time to that first event is over budget, or when a
+# network client library or a database was touched along the way.
+#
+#     python bench/startup.py [budget ms] [runs]
+
+from typing import Dict, List, Tuple
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY = ('requests', 'requests_oauthlib', 'oauthlib', 'urllib3')
+
+CHILD = '''
+import sys, time
+start = time.perf_counter()
+import tipbot
+imported = time.perf_counter()
+tipbot.main({'tweet_create_events': [{'text': 'nice weather @' + tipbot.BOTSCREENNAME, 'id_str': '1', 'user': {'id_str': '2', 'screen_name': 'someone', 'name': 'someone'}}]})
+handled = time.perf_counter()
+print(json.dumps({'import': imported - start, 'event': handled - start, 'loaded': [name for name in HEAVY if name in sys.modules], 'connections': len(getattr(tipbot.aw.local, 'conns', {}))}))
+'''
+
+def run_once() -> Tuple[Dict, List[Tuple[int, str]]]:
+    code = f'import json\nHEAVY = {HEAVY!r}\n' + CHILD
+    # config.py comes from PYTHONPATH or the working directory, ahead of the checkout
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(os.environ.get('PYTHONPATH', '').split(os.pathsep) + [ROOT]))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env = env, capture_output = True, text = True, check = True)
+    modules = []
+
+    for line in process.stderr.splitlines():
+        fields = line.split('|')
+
+        if not line.startswith('import time:') or not fields[1].strip().isdigit():
+            continue
+
+        modules.append((int(fields[1]), fields[2].strip()))
+
+    return json.loads(process.stdout.splitlines()[-1]), modules
+
+def main() -> None:
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    results = [run_once() for i in range(runs)]
+    events = sorted(result['event'] * 1000 for result, modules in results)
+    imports = sorted(result['import'] * 1000 for result, modules in results)
+    result, modules = results[-1]
+
+    print('slowest imports (cumulative us):')
+
+    for cumulative, name in sorted(modules, reverse = True)[:10]:
+        print(f'{cumulative:>10}  {name}')
+
+    print(f'import tipbot: {imports[runs // 2]:.1f} ms, first event handled: {events[runs // 2]:.1f} ms (median of {runs}, budget {budget:.0f} ms)')
+
+    failures = []
+
+    if events[runs // 2] > budget:
+        failures.append(f'first event took {events[runs // 2]:.1f} ms')
+
+    if len(result['loaded']) > 0:
+        failures.append('loaded at startup: ' + ', '.join(result['loaded']))
+
+    if result['connections'] > 0:
+        failures.append(f'{result["connections"]} wallet databases opened')
+
+    for failure in failures:
+        print('FAIL:', failure)
+
+    sys.exit(1 if len(failures) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
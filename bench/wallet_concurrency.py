@@ -0,0 +1,122 @@
+# Concurrent stress test for accountwallet.move: each thread tips back and
+# forth within its own pair of accounts (disjoint) or out of one shared
+# account (hot). Reports tips per second, the mean time a writer waited for
+# the lock per tip and the time spent running statements inside write
+# transactions per tip. Within one file disjoint tips still take turns on the
+# same writer lock, which is held through the commit as well.
+# Checks that no balance goes negative, that the total is conserved and that
+# the ledger still matches the balances. With more than
+# one shard most pairs span two shards and go through the two-phase transfer.
+#
+#     python bench/wallet_concurrency.py [tips per thread] [threads,...] [shards]
+
+from typing import List, Tuple
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+config.WALLETDBPATH = os.path.join(tempfile.mkdtemp(), 'wallet.db')
+config.WALLETSHARDS = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+config.METRICSDIR = None
+
+import accountwallet as aw
+
+aw.init_db()
+
+# seconds spent inside the bodies of write transactions, between begin and commit
+held = [0.0]
+transaction = aw.transaction
+
+def timed_transaction(sql_func, read_only: bool, *args, **kwargs):
+    if read_only:
+        return transaction(sql_func, read_only, *args, **kwargs)
+
+    def body(cursor, *args, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            return sql_func(cursor, *args, **kwargs)
+
+        finally:
+            held[0] += time.perf_counter() - start
+
+    body.__name__ = sql_func.__name__
+
+    return transaction(body, read_only, *args, **kwargs)
+
+aw.transaction = timed_transaction
+
+@aw.sql_decorator
+def seed(cursor, accounts: List[str], units: int) -> None:
+    for account in accounts:
+        cursor.execute('insert or ignore into account_wallet(account) values(?)', (account,))
+        aw.credit(cursor, account, units, 'deposit', 'stress')
+
+@aw.read_sql_decorator
+def totals(cursor) -> tuple:
+    cursor.execute('select coalesce(sum(balance), 0), coalesce(min(balance), 0) from account_wallet')
+
+    return cursor.fetchone()
+
+# (tips per second, lock wait per tip, time in write transactions per tip) in seconds
+def run(threads: int, tips: int, hot: bool) -> Tuple[float, float, float]:
+    waited = aw.lock_stats['wait_seconds']
+    prefix = f'{"hot" if hot else "disjoint"}-{threads}'
+
+    for account in [f'{prefix}-{i}-{side}' for i in range(threads) for side in 'ab']:
+        seed(aw.shard_of(account), [account], aw.to_units('1'))
+
+    def work(i: int) -> None:
+        for n in range(tips):
+            if hot:
+                aw.move(f'{prefix}-0-a', f'{prefix}-{i}-b', '0.00000001')
+
+            else:
+                aw.move(f'{prefix}-{i}-{"ab"[n % 2]}', f'{prefix}-{i}-{"ba"[n % 2]}', '0.001')
+
+    workers = [threading.Thread(target = work, args = (i,)) for i in range(threads)]
+    inside = held[0]
+    start = time.perf_counter()
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    return (threads * tips / (time.perf_counter() - start), (aw.lock_stats['wait_seconds'] - waited) / (threads * tips), (held[0] - inside) / (threads * tips))
+
+def main() -> None:
+    tips = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    levels = [int(level) for level in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4, 8, 16]
+
+    print(f'{"threads":>8}{"disjoint tips/s":>17}{"wait/tip ms":>13}{"in tx us":>10}{"hot tips/s":>12}{"wait/tip ms":>13}{"in tx us":>10}{"retries":>9}')
+
+    for threads in levels:
+        retries = aw.lock_stats['retries']
+        disjoint, disjoint_wait, disjoint_held = run(threads, tips, False)
+        hot, hot_wait, hot_held = run(threads, tips, True)
+
+        print(f'{threads:>8}{disjoint:>17.0f}{disjoint_wait * 1000:>13.3f}{disjoint_held * 1000000:>10.1f}{hot:>12.0f}{hot_wait * 1000:>13.3f}{hot_held * 1000000:>10.1f}{aw.lock_stats["retries"] - retries:>9}')
+
+    shards = [totals(shard) for shard in range(config.WALLETSHARDS)]
+    total = sum(total for total, lowest in shards)
+    lowest = min(lowest for total, lowest in shards)
+    expected = aw.to_units('1') * 2 * 2 * sum(levels)
+
+    assert total == expected, f'total {total} != {expected}'
+    assert lowest >= 0, f'negative balance {lowest}'
+    assert all(aw.verify_ledger(shard) == [] for shard in range(config.WALLETSHARDS)), 'ledger does not match balances'
+    assert all(aw.pending_transfers(shard, 2 ** 62) == [] for shard in range(config.WALLETSHARDS)), 'transfers left unsettled'
+
+    print('invariants hold: total conserved, no negative balance, ledger matches')
+
+
+if __name__ == '__main__':
+    main()
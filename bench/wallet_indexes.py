@@ -0,0 +1,74 @@
+# Times the wallet hot-path queries against tables of growing size, with
+# the schema before (user_version 1) and after (user_version 2) the index
+# migration.
+#
+#     python bench/wallet_indexes.py [max_rows]
+
+from typing import List, Tuple
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import accountwallet as aw
+
+QUERIES = [
+    ('notify_tx address', 'select account from account_address where address == ?', lambda n: (f'k{random.randrange(n)}',)),
+    ('notify_tx duplicate', 'select * from notified_tx where txid == ?', lambda n: (f'tx{random.randrange(n)}',)),
+    ('get_account_address', 'select address from account_address where account == ? and time > ?', lambda n: (f'twitter-{random.randrange(n // 10)}', n - 100)),
+    ('get_account_balance', 'select value from notified_tx where account == ? and confirmed == 0 and time > ?', lambda n: (f'twitter-{random.randrange(n // 10)}', n - 100)),
+    ('check_tx', 'select txid from notified_tx where confirmed == 0 and time > ?', lambda n: (n - 100,)),
+    ('exec_withdrawal', 'select amount from withdrawal_req where address == ? and completed == 0', lambda n: (f'k{random.randrange(n)}',)),
+]
+
+def populate(cursor: sqlite3.Cursor, n: int) -> None:
+    cursor.executemany('insert into account_address(account, address, time) values(?, ?, ?)', ((f'twitter-{i // 10}', f'k{i}', i) for i in range(n)))
+    cursor.executemany('insert into notified_tx(txid, time, confirmed, account, value) values(?, ?, ?, ?, ?)', ((f'tx{i}', i, 0 if i > n - 100 else 1, f'twitter-{i // 10}', 1.0) for i in range(n)))
+    cursor.executemany('insert into withdrawal_req(account, address, amount, completed) values(?, ?, ?, ?)', ((f'twitter-{i // 10}', f'k{i}', 1.0, 0 if i > n - 100 else 1) for i in range(n)))
+
+def measure(path: str, n: int, version: int, repeat: int = 200) -> List[Tuple[str, float]]:
+    conn = sqlite3.connect(path, isolation_level = None)
+    cursor = conn.cursor()
+
+    cursor.execute('begin')
+    for migration in aw.migrations[:version]:
+        migration(cursor)
+    populate(cursor, n)
+    cursor.execute('commit')
+    cursor.execute('analyze')
+
+    results = []
+
+    for name, sql, params in QUERIES:
+        start = time.perf_counter()
+
+        for i in range(repeat):
+            cursor.execute(sql, params(n)).fetchall()
+
+        results.append((name, (time.perf_counter() - start) / repeat * 1e6))
+
+    conn.close()
+
+    return results
+
+def main() -> None:
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    sizes = [n for n in (1000, 10000, 100000, 1000000, 10000000) if n <= max_rows]
+
+    print(f'{"query":<22}{"rows":>10}{"no index (us)":>16}{"indexed (us)":>16}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            before = measure(os.path.join(directory, f'v1-{n}.db'), n, 1, 5 if n >= 100000 else 50)
+            after = measure(os.path.join(directory, f'v2-{n}.db'), n, 2)
+
+            for (name, before_us), (_, after_us) in zip(before, after):
+                print(f'{name:<22}{n:>10}{before_us:>16.1f}{after_us:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Wallet write throughput across processes, the way several eventd or
+# walletd processes would share the wallet: each process tips back and forth
+# within its own pair of accounts, both accounts of the pair in the same
+# shard, so the only thing processes contend for is the shard's writer lock.
+# Prints aggregate tips per second for each process count and shard count.
+#
+#     python bench/wallet_processes.py [tips per process] [processes,...] [shards,...]
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# the second account is searched for rather than numbered like the first,
+# because crc32 of two names that differ in one fixed byte always differs
+# by the same bits and would never land in the same shard
+PAIR = '''
+def pair(process):
+    a = 'p%d-a' % process
+    return a, next(b for b in ('p%d-b%d' % (process, i) for i in range(10000)) if aw.shard_of(b) == aw.shard_of(a))
+'''
+
+CHILD = '''
+import sys, time
+import config
+config.WALLETDBPATH = sys.argv[1]
+config.WALLETSHARDS = int(sys.argv[2])
+config.METRICSDIR = None
+import accountwallet as aw
+a, b = pair(int(sys.argv[3]))
+tips = int(sys.argv[4])
+sys.stdout.write('ready\\n')
+sys.stdout.flush()
+sys.stdin.readline()
+for n in range(tips):
+    aw.move(a if n % 2 == 0 else b, b if n % 2 == 0 else a, '0.001')
+'''
+
+SEED = '''
+import sys
+import config
+config.WALLETDBPATH = sys.argv[1]
+config.WALLETSHARDS = int(sys.argv[2])
+config.METRICSDIR = None
+import accountwallet as aw
+aw.init_db()
+@aw.sql_decorator
+def seed(cursor, account):
+    cursor.execute('insert or ignore into account_wallet(account) values(?)', (account,))
+    aw.credit(cursor, account, aw.to_units('1000'), 'deposit', 'bench')
+for process in range(int(sys.argv[3])):
+    for account in pair(process):
+        seed(aw.shard_of(account), account)
+'''
+
+def env() -> dict:
+    return dict(os.environ, PYTHONPATH = os.pathsep.join([ROOT] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+
+def run(processes: int, shards: int, tips: int) -> float:
+    path = os.path.join(tempfile.mkdtemp(), 'wallet.db')
+    subprocess.run([sys.executable, '-c', PAIR + SEED, path, str(shards), str(processes)], env = env(), check = True)
+
+    children = [subprocess.Popen([sys.executable, '-c', PAIR + CHILD, path, str(shards), str(process), str(tips)], env = env(), stdin = subprocess.PIPE, stdout = subprocess.PIPE, text = True) for process in range(processes)]
+
+    # start every process at once, after their imports
+    for child in children:
+        child.stdout.readline()
+
+    start = time.perf_counter()
+
+    for child in children:
+        child.stdin.write('\n')
+        child.stdin.flush()
+
+    for child in children:
+        if child.wait() != 0:
+            raise RuntimeError('a tipping process failed')
+
+    return processes * tips / (time.perf_counter() - start)
+
+def main() -> None:
+    tips = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    levels = [int(level) for level in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4, 8]
+    shard_counts = [int(shards) for shards in sys.argv[3].split(',')] if len(sys.argv) > 3 else [1, 4]
+
+    print(f'{"processes":>10}' + ''.join(f'{f"{shards} shard tips/s":>18}' for shards in shard_counts))
+
+    for processes in levels:
+        print(f'{processes:>10}' + ''.join(f'{run(processes, shards, tips):>18.0f}' for shards in shard_counts))
+
+
+if __name__ == '__main__':
+    main()
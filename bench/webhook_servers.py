@@ -0,0 +1,153 @@
+# Compares the two webhook front ends, aaapi (Flask on werkzeug's threaded
+# server) and aaapi_async (aiohttp), on the same signed deliveries. Each
+# server runs in its own process against a scratch event queue with no
+# eventd, so only receiving, admission and the queue insert are measured.
+# --idle holds that many extra connections open mid-request during the run,
+# like slow or stalled clients.
+#
+#     python bench/webhook_servers.py --requests 2000 --clients 16 --idle 0,200
+
+from typing import Dict, List
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import webhooks
+
+SERVER = '''
+import sys
+import config
+config.EVENTDBPATH = sys.argv[1]
+config.METRICSDIR = None
+config.QUEUESIZE = 10 ** 9
+import webhook
+webhook.USERBURST = 10 ** 9
+
+if sys.argv[2] == 'flask':
+    from werkzeug.serving import run_simple
+    import aaapi
+    run_simple('127.0.0.1', int(sys.argv[3]), aaapi.application, threaded = True)
+
+else:
+    from aiohttp import web
+    import aaapi_async
+    web.run_app(aaapi_async.application, host = '127.0.0.1', port = int(sys.argv[3]), print = None)
+'''
+
+def free_port() -> int:
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+def start_server(kind: str) -> subprocess.Popen:
+    port = free_port()
+    path = os.path.join(tempfile.mkdtemp(), 'event.db')
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([root] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    process = subprocess.Popen([sys.executable, '-c', SERVER, path, kind, str(port)], env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    process.port = port
+
+    for i in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout = 1).close()
+            return process
+
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f'{kind} server did not start')
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run(kind: str, requests: int, clients: int, idle: int) -> Dict:
+    process = start_server(kind)
+    stalled = []
+
+    try:
+        for i in range(idle):
+            sock = socket.create_connection(('127.0.0.1', process.port))
+            sock.sendall(b'POST /twitter HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: 100\r\n\r\n{')
+            stalled.append(sock)
+
+        deliveries = iter(list(webhooks.payloads(requests)))
+        lock = threading.Lock()
+        latencies = []
+        errors = [0]
+
+        def client() -> None:
+            while True:
+                with lock:
+                    delivery = next(deliveries, None)
+
+                if delivery is None:
+                    return
+
+                body, headers, key = delivery
+                start = time.perf_counter()
+
+                try:
+                    conn = http.client.HTTPConnection('127.0.0.1', process.port, timeout = 30)
+                    conn.request('POST', '/twitter', body = body, headers = headers)
+                    status = conn.getresponse().status
+                    conn.close()
+
+                except OSError:
+                    status = 0
+
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    errors[0] += status != 200
+
+        threads = [threading.Thread(target = client) for i in range(clients)]
+        start = time.perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+
+    finally:
+        for sock in stalled:
+            sock.close()
+
+        process.kill()
+        process.wait()
+
+    return {'server': kind, 'idle': idle, 'per_sec': requests / elapsed, 'p50': percentile(latencies, 0.5), 'p99': percentile(latencies, 0.99), 'errors': errors[0]}
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type = int, default = 2000)
+    parser.add_argument('--clients', type = int, default = 16)
+    parser.add_argument('--idle', default = '0,200', help = 'comma separated counts of stalled connections')
+    args = parser.parse_args()
+
+    print(f'{"server":>8}{"idle":>6}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}')
+
+    for idle in [int(idle) for idle in args.idle.split(',')]:
+        for kind in ('flask', 'aiohttp'):
+            r = run(kind, args.requests, args.clients, idle)
+            print(f'{r["server"]:>8}{r["idle"]:>6}{r["per_sec"]:>9.1f}{r["p50"] * 1000:>9.1f}{r["p99"] * 1000:>9.1f}{r["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Generates correctly signed Account Activity webhook deliveries with a
+# configurable mix of tip/balance/deposit/withdraw commands and noise.
+
+from typing import Dict, Iterator, Optional, Tuple
+import json
+import random
+from webhook import sig
+from config import BOTSCREENNAME
+
+MIX = {'tip': 50, 'balance': 20, 'deposit': 10, 'withdraw': 5, 'noise': 15}
+
+NOISE = ['すごい！ Koto最高', 'おはようございます', 'これってどうやって使うの？', 'RT @akarinSS: tip @someone 1']
+
+def sender(i: int) -> Dict:
+    return {'id_str': str(100000 + i), 'screen_name': f'user{i}', 'name': f'User{i}'}
+
+def command(kind: str, users: int, rng: random.Random) -> str:
+    if kind == 'tip':
+        return f'tip @user{rng.randrange(users)} 0.001 thanks!'
+
+    if kind == 'withdraw':
+        address = 'k1' + ''.join(rng.choice('abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ123456789') for i in range(33))
+        return f'withdraw {address} 0.01'
+
+    if kind == 'noise':
+        return rng.choice(NOISE)
+
+    return kind
+
+def payloads(count: int, users: int = 1000, mix: Dict[str, int] = MIX, dm_ratio: float = 0.2, seed: int = 0) -> Iterator[Tuple[bytes, Dict[str, str], Optional[Tuple[str, str]]]]:
+    """Yields (body, headers, expected reply key) for count deliveries."""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    for n in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        user = sender(rng.randrange(users))
+        text = command(kind, users, rng)
+        id_str = str(10 ** 18 + seed * 10 ** 9 + n)
+
+        if rng.random() < dm_ratio:
+            event = {'type': 'message_create', 'id': id_str, 'message_create': {'sender_id': user['id_str'], 'message_data': {'text': text}}}
+            data = {'direct_message_events': [event], 'users': {user['id_str']: user}}
+            key = ('direct_messages/events/new', user['id_str'])
+
+        else:
+            event = {'id_str': id_str, 'text': f'@{BOTSCREENNAME} {text}', 'user': user}
+            data = {'tweet_create_events': [event]}
+            key = ('statuses/update', id_str)
+
+        if kind == 'noise':
+            key = None
+
+        body = json.dumps(data).encode()
+
+        yield (body, {'X-Twitter-Webhooks-Signature': sig(body), 'Content-Type': 'application/json'}, key)
@@ -1,11 +1,76 @@
-from typing import Any
+from typing import TYPE_CHECKING, Any, List, Sequence, Tuple
 import json
-import requests
+import threading
+import time
+import metrics
 from config import RPCUSER, RPCPASSWORD, RPCPORT
 
-def call(method: str, *params: Any) -> Any:
+if TYPE_CHECKING:
+    import requests
+
+URL = f'http://localhost:{RPCPORT}'
+TIMEOUT = 30
+RETRIES = 3
+
+# requests is only imported by the first call, so importing coinrpc is cheap
+session = None
+session_lock = threading.Lock()
+
+def get_session() -> 'requests.Session':
+    global session
+
+    with session_lock:
+        if session is None:
+            import requests
+
+            session = requests.Session()
+            session.auth = (RPCUSER, RPCPASSWORD)
+            session.headers.update({'content-type': 'text/plain'})
+
+    return session
+
+def post(data: str, retries: int) -> Any:
+    import requests
+
+    for i in range(retries + 1):
+        try:
+            response = get_session().post(URL, data = data, timeout = TIMEOUT)
+
+        except (requests.ConnectionError, requests.Timeout) as err:
+            e = err
+            time.sleep(0.5 * 2 ** i)
+            continue
+
+        return response.json()
+
+    raise e
+
+def call(method: str, *params: Any, retries: int = RETRIES) -> Any:
     data = json.dumps({'jsonrpc': '1.0', 'id': '', 'method': method, 'params': params})
-    response = requests.post(f'http://localhost:{RPCPORT}', auth = (RPCUSER, RPCPASSWORD), headers = {'content-type': 'text/plain'}, data = data)
+    start = time.perf_counter()
+
+    try:
+        return post(data, retries).get('result')
+
+    finally:
+        metrics.observe('coinrpc_call_seconds', time.perf_counter() - start, method = method)
+
+def call_batch(calls: Sequence[Tuple[str, Sequence[Any]]], retries: int = RETRIES) -> List[Tuple[Any, Any]]:
+    if len(calls) == 0:
+        return []
+
+    data = json.dumps([{'jsonrpc': '1.0', 'id': i, 'method': method, 'params': list(params)} for i, (method, params) in enumerate(calls)])
+    start = time.perf_counter()
+
+    try:
+        results = post(data, retries)
+
+    finally:
+        metrics.observe('coinrpc_call_seconds', time.perf_counter() - start, method = 'batch:' + calls[0][0])
+
+    if not isinstance(results, list):
+        return [(None, results.get('error'))] * len(calls)
 
-    return response.json().get('result')
+    responses = {r.get('id'): r for r in results}
 
+    return [(responses.get(i, {}).get('result'), responses.get(i, {}).get('error')) for i in range(len(calls))]
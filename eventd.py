@@ -0,0 +1,102 @@
+import os
+import socket
+import threading
+import time
+import accountwallet
+import eventqueue
+import metrics
+import outbox
+import tipbot
+import webhook
+from config import WORKERS
+
+# one event per claim, so no sender waits behind another sender's event in the same worker
+BATCHSIZE = 1
+POLLINTERVAL = 1
+# a tip or withdrawal is made at most once per event, so a failed event is
+# run again, after RETRYDELAY, 2 * RETRYDELAY, ... seconds
+MAXATTEMPTS = 3
+RETRYDELAY = 5
+
+arrived = threading.Condition()
+
+def receive(sock: socket.socket) -> None:
+    while True:
+        sock.recv(64)
+
+        with arrived:
+            arrived.notify_all()
+
+def worker() -> None:
+    pruned = 0
+
+    while True:
+        batch = eventqueue.claim(BATCHSIZE)
+
+        if len(batch) == 0:
+            if time.time() - pruned > 60 * 60:
+                eventqueue.prune(60 * 60 * 24)
+                pruned = time.time()
+
+            with arrived:
+                arrived.wait(timeout = POLLINTERVAL)
+
+            continue
+
+        for id, data, attempts in batch:
+            try:
+                tipbot.main(data)
+
+            except Exception as err:
+                print('Error:', err)
+
+                if attempts + 1 < MAXATTEMPTS:
+                    eventqueue.retry(id, RETRYDELAY * 2 ** attempts)
+                    metrics.inc('webhook_events_total', result = 'retried')
+                    continue
+
+                eventqueue.fail(id)
+                metrics.inc('webhook_events_total', result = 'failed')
+
+                try:
+                    tipbot.apologize(data)
+
+                except Exception as err:
+                    print('Error:', err)
+
+                continue
+
+            eventqueue.done(id)
+
+# the only consumer of the event and reply queues: events and replies that
+# were claimed when the last eventd stopped are put back once, here, and
+# the wallet ignores a tip or withdrawal it has already made for an event
+def start() -> None:
+    accountwallet.init_db()
+    eventqueue.init_db()
+    outbox.init_db()
+
+    print(f'{eventqueue.replay()} events and {outbox.replay()} replies replayed')
+
+    if os.path.exists(webhook.EVENTDSOCKET):
+        os.remove(webhook.EVENTDSOCKET)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(webhook.EVENTDSOCKET)
+
+    threading.Thread(target = receive, args = (sock,), daemon = True).start()
+
+    for i in range(WORKERS):
+        threading.Thread(target = worker, daemon = True).start()
+
+    threading.Thread(target = outbox.sender, daemon = True).start()
+
+def main() -> None:
+    start()
+
+    while True:
+        time.sleep(60 * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+from typing import Any, Callable, Dict, List, Set, Tuple
+import json
+import sqlite3
+import threading
+import time
+from config import EVENTDBPATH
+
+local = threading.local()
+
+
+# decorator
+def sql_decorator(sql_func: Callable) -> Callable:
+    def new_sql_func(*args: Any, **kwargs: Any) -> Any:
+        conn = getattr(local, 'conn', None)
+
+        if conn is None:
+            conn = sqlite3.connect(EVENTDBPATH, timeout = 60, isolation_level = None)
+            conn.execute('pragma journal_mode = WAL')
+            local.conn = conn
+
+        cursor = conn.cursor()
+        cursor.execute('begin IMMEDIATE')
+
+        try:
+            r = sql_func(cursor, *args, **kwargs)
+
+        except:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        return r
+
+    return new_sql_func
+
+@sql_decorator
+def init_db(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists event(id integer primary key, event_id text unique not null, payload text not null, status integer default 0 not null, time integer not null)')
+    cursor.execute('create index if not exists event_status on event(status, id)')
+
+    cursor.execute('pragma user_version')
+    version = cursor.fetchone()[0]
+
+    if version < 1:
+        cursor.execute('alter table event add column sender text')
+
+    if version < 2:
+        cursor.execute('alter table event add column priority integer default 1 not null')
+
+    if version < 3:
+        cursor.execute('alter table event add column attempts integer default 0 not null')
+        cursor.execute('alter table event add column next_time real default 0 not null')
+
+    cursor.execute('pragma user_version = 3')
+
+    cursor.execute('create index if not exists event_sender on event(sender, id) where status in (0, 1)')
+    cursor.execute('create index if not exists event_priority on event(priority, id) where status == 0')
+
+# (event id, sender id, single event payload) for every event tipbot handles
+def split(data: Dict) -> List[Tuple[str, str, Dict]]:
+    events = []
+
+    for event in data.get('tweet_create_events', []):
+        events.append(('tweet-' + event['id_str'], event['user']['id_str'], {'tweet_create_events': [event]}))
+
+    for event in data.get('direct_message_events', []):
+        if event['type'] != 'message_create':
+            continue
+
+        sender_id = event['message_create']['sender_id']
+        events.append(('dm-' + event['id'], sender_id, {'direct_message_events': [event], 'users': {sender_id: data['users'][sender_id]}}))
+
+    return events
+
+# events are (event id, sender id, payload, priority), lower priorities are claimed first
+@sql_decorator
+def push(cursor: sqlite3.Cursor, events: List[Tuple[str, str, Dict, int]]) -> int:
+    count = 0
+
+    for event_id, sender, payload, priority in events:
+        cursor.execute('insert or ignore into event(event_id, sender, payload, priority, time) values(?, ?, ?, ?, ?)', (event_id, sender, json.dumps(payload), priority, int(time.time())))
+        count = count + cursor.rowcount
+
+    return count
+
+# which of event_ids are already in the queue, e.g. redelivered by Twitter
+@sql_decorator
+def known(cursor: sqlite3.Cursor, event_ids: List[str]) -> Set[str]:
+    cursor.execute(f'select event_id from event where event_id in ({", ".join("?" * len(event_ids))})', event_ids)
+
+    return {r[0] for r in cursor.fetchall()}
+
+@sql_decorator
+def pending(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('select count(*) from event where status == 0')
+
+    return cursor.fetchone()[0]
+
+# only a sender's oldest unfinished event can be claimed, so each sender's
+# events run one at a time and in order while different senders run in
+# parallel, and priority only decides between senders. An event waiting to
+# be retried holds back the rest of its sender's events.
+@sql_decorator
+def claim(cursor: sqlite3.Cursor, limit: int) -> List[Tuple[int, Dict, int]]:
+    cursor.execute('select id, payload, attempts from event as e where status == 0 and next_time <= ? and id == (select min(id) from event where sender is e.sender and status in (0, 1)) order by priority, id limit ?', (time.time(), limit))
+    events = [(r[0], json.loads(r[1]), r[2]) for r in cursor.fetchall()]
+
+    cursor.executemany('update event set status = 1 where id == ?', [(r[0],) for r in events])
+
+    return events
+
+@sql_decorator
+def done(cursor: sqlite3.Cursor, id: int) -> None:
+    cursor.execute('update event set status = 2 where id == ?', (id,))
+
+@sql_decorator
+def retry(cursor: sqlite3.Cursor, id: int, delay: float) -> None:
+    cursor.execute('update event set status = 0, attempts = attempts + 1, next_time = ? where id == ?', (time.time() + delay, id))
+
+@sql_decorator
+def fail(cursor: sqlite3.Cursor, id: int) -> None:
+    cursor.execute('update event set status = -1 where id == ?', (id,))
+
+@sql_decorator
+def replay(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('update event set status = 0 where status == 1')
+
+    return cursor.rowcount
+
+@sql_decorator
+def prune(cursor: sqlite3.Cursor, age: int) -> int:
+    cursor.execute('delete from event where status in (2, -1) and time < ?', (int(time.time()) - age,))
+
+    return cursor.rowcount
@@ -0,0 +1,152 @@
+from typing import Dict, List, Tuple
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from config import METRICSDIR
+
+# every process keeps its own counters and histograms and writes them to
+# METRICSDIR/<pid>.json, render() sums the files of all processes
+ENABLED = METRICSDIR is not None
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FLUSHINTERVAL = 5
+
+lock = threading.Lock()
+# 'name|labels' -> value, or -> [count per bucket..., +Inf count, sum, count]
+counters = {}
+histograms = {}
+flusher = None
+
+def key(name: str, labels: Dict[str, str]) -> str:
+    return name + '|' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    if not ENABLED:
+        return
+
+    k = key(name, labels)
+
+    with lock:
+        counters[k] = counters.get(k, 0) + value
+
+    start_flusher()
+
+def observe(name: str, seconds: float, **labels: str) -> None:
+    if not ENABLED:
+        return
+
+    k = key(name, labels)
+
+    with lock:
+        histogram = histograms.get(k)
+
+        if histogram is None:
+            histogram = histograms[k] = [0] * (len(BUCKETS) + 3)
+
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+
+        else:
+            histogram[len(BUCKETS)] += 1
+
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+    start_flusher()
+
+def flush() -> None:
+    with lock:
+        snapshot = json.dumps({'counters': counters, 'histograms': histograms})
+
+    path = os.path.join(METRICSDIR, f'{os.getpid()}.json')
+
+    with open(path + '.tmp', 'w') as f:
+        f.write(snapshot)
+
+    os.replace(path + '.tmp', path)
+
+def flush_forever() -> None:
+    while True:
+        time.sleep(FLUSHINTERVAL)
+
+        try:
+            flush()
+
+        except Exception as err:
+            print('Error:', err)
+
+def start_flusher() -> None:
+    global flusher
+
+    if flusher is not None:
+        return
+
+    with lock:
+        if flusher is not None:
+            return
+
+        os.makedirs(METRICSDIR, exist_ok = True)
+        flusher = threading.Thread(target = flush_forever, daemon = True)
+        flusher.start()
+
+    atexit.register(flush)
+
+def render(gauges: Dict[str, float] = {}) -> str:
+    if flusher is not None:
+        flush()
+
+    merged_counters = {}
+    merged_histograms = {}
+
+    for path in glob.glob(os.path.join(METRICSDIR, '*.json')):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+
+        except (OSError, ValueError):
+            continue
+
+        for k, value in snapshot['counters'].items():
+            merged_counters[k] = merged_counters.get(k, 0) + value
+
+        for k, histogram in snapshot['histograms'].items():
+            merged = merged_histograms.setdefault(k, [0] * len(histogram))
+            merged_histograms[k] = [a + b for a, b in zip(merged, histogram)]
+
+    lines = []
+
+    for name, kind, series in sorted(group(merged_counters, 'counter') + group(merged_histograms, 'histogram') + group(gauges, 'gauge')):
+        lines.append(f'# TYPE {name} {kind}')
+
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f'{series_name(name, labels)} {value}')
+                continue
+
+            cumulative = 0
+
+            for bound, count in zip(BUCKETS + ('+Inf',), value[:-2]):
+                cumulative = cumulative + count
+                bucket_labels = (labels + ',' if labels else '') + f'le="{bound}"'
+                lines.append(f'{series_name(name + "_bucket", bucket_labels)} {cumulative}')
+
+            lines.append(f'{series_name(name + "_sum", labels)} {value[-2]}')
+            lines.append(f'{series_name(name + "_count", labels)} {value[-1]}')
+
+    return '\n'.join(lines) + '\n'
+
+def series_name(name: str, labels: str) -> str:
+    return f'{name}{{{labels}}}' if labels else name
+
+def group(values: Dict, kind: str) -> List[Tuple[str, str, List]]:
+    names = {}
+
+    for k, value in values.items():
+        name, _, labels = k.partition('|')
+        names.setdefault(name, []).append((labels, value))
+
+    return [(name, kind, sorted(series)) for name, series in names.items()]
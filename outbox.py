@@ -0,0 +1,137 @@
+from typing import List, Tuple
+import random
+import sqlite3
+import threading
+import time
+import metrics
+import twitter
+from eventqueue import sql_decorator
+
+ENDPOINTS = {'tweet': 'statuses/update', 'dm': 'direct_messages/events/new'}
+MAXATTEMPTS = 8
+BACKOFF = 5
+MAXBACKOFF = 60 * 15
+
+arrived = threading.Condition()
+
+stats_lock = threading.Lock()
+stats = {'sent': 0, 'failed': 0, 'retried': 0, 'send_seconds': 0.0, 'queue_seconds': 0.0}
+
+@sql_decorator
+def init_db(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('create table if not exists reply(id integer primary key, kind text not null, text text not null, target text not null, status integer default 0 not null, attempts integer default 0 not null, next_time real not null, time real not null)')
+    cursor.execute('create index if not exists reply_pending on reply(next_time) where status == 0')
+
+@sql_decorator
+def store(cursor: sqlite3.Cursor, kind: str, text: str, target: str) -> None:
+    cursor.execute('insert into reply(kind, text, target, next_time, time) values(?, ?, ?, ?, ?)', (kind, text, target, time.time(), time.time()))
+
+def push(kind: str, text: str, target: str) -> None:
+    store(kind, text, target)
+
+    with arrived:
+        arrived.notify()
+
+@sql_decorator
+def depth(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('select count(*) from reply where status == 0')
+
+    return cursor.fetchone()[0]
+
+@sql_decorator
+def claim(cursor: sqlite3.Cursor, limit: int) -> List[Tuple[int, str, str, str, int, float]]:
+    cursor.execute('select id, kind, text, target, attempts, time from reply where status == 0 and next_time <= ? order by next_time limit ?', (time.time(), limit))
+    replies = cursor.fetchall()
+
+    cursor.executemany('update reply set status = 1 where id == ?', [(r[0],) for r in replies])
+
+    return replies
+
+@sql_decorator
+def finish(cursor: sqlite3.Cursor, id: int, status: int) -> None:
+    cursor.execute('update reply set status = ? where id == ?', (status, id))
+
+@sql_decorator
+def postpone(cursor: sqlite3.Cursor, id: int, attempts: int, delay: float) -> None:
+    cursor.execute('update reply set status = 0, attempts = ?, next_time = ? where id == ?', (attempts, time.time() + delay, id))
+
+@sql_decorator
+def replay(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('update reply set status = 0 where status == 1')
+
+    return cursor.rowcount
+
+def send(kind: str, text: str, target: str) -> int:
+    try:
+        if kind == 'tweet':
+            response = twitter.tweet(text, target)
+
+        else:
+            response = twitter.dm(text, target)
+
+    except Exception as err:
+        print('Error:', err)
+        return 0
+
+    return response.status_code
+
+def deliver(id: int, kind: str, text: str, target: str, attempts: int, queued: float) -> None:
+    wait = twitter.wait_time(ENDPOINTS[kind])
+
+    if wait > 0:
+        postpone(id, attempts, wait)
+        return
+
+    start = time.time()
+    status_code = send(kind, text, target)
+    end = time.time()
+
+    with stats_lock:
+        stats['send_seconds'] += end - start
+
+    metrics.observe('reply_send_seconds', end - start, kind = kind)
+
+    if 200 <= status_code < 300:
+        finish(id, 2)
+
+        with stats_lock:
+            stats['sent'] += 1
+            stats['queue_seconds'] += end - queued
+
+        metrics.inc('replies_total', kind = kind, result = 'sent')
+        metrics.observe('reply_queue_seconds', end - queued, kind = kind)
+
+        return
+
+    # 429, 5xx and network errors are retried, any other error is final
+    if (status_code == 429 or status_code == 0 or status_code >= 500) and attempts + 1 < MAXATTEMPTS:
+        delay = max(twitter.wait_time(ENDPOINTS[kind]), min(MAXBACKOFF, BACKOFF * 2 ** attempts) * random.uniform(0.5, 1.5))
+        postpone(id, attempts + 1, delay)
+
+        with stats_lock:
+            stats['retried'] += 1
+
+        metrics.inc('replies_total', kind = kind, result = 'retried')
+
+        return
+
+    print('Error: reply failed', kind, target, status_code)
+    finish(id, -1)
+
+    with stats_lock:
+        stats['failed'] += 1
+
+    metrics.inc('replies_total', kind = kind, result = 'failed')
+
+def sender() -> None:
+    while True:
+        replies = claim(10)
+
+        if len(replies) == 0:
+            with arrived:
+                arrived.wait(timeout = 1)
+
+            continue
+
+        for reply in replies:
+            deliver(*reply)
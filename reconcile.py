@@ -0,0 +1,246 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import sys
+import time
+import accountwallet as aw
+import coinrpc
+from config import WALLETDBPATH, MINCONF
+
+# accounts are read CHUNK at a time, each chunk in its own read transaction,
+# and the node's transactions PAGESIZE at a time, PAGESPERBATCH pages per RPC
+# and per check
+CHUNK = 500
+PAGESIZE = 1000
+PAGESPERBATCH = 5
+CHECKPOINTPATH = WALLETDBPATH + '.reconcile'
+
+def new_state() -> Dict[str, Any]:
+    return {'phase': 'accounts', 'shard': 0, 'rowid': 0, 'skip': 0, 'started': int(time.time()), 'balances': 0, 'withdrawals': 0, 'transfers': 0, 'accounts': 0, 'transactions': 0, 'discrepancies': 0, 'carry': []}
+
+def load_state() -> Dict[str, Any]:
+    if not os.path.exists(CHECKPOINTPATH):
+        return new_state()
+
+    with open(CHECKPOINTPATH) as f:
+        return json.load(f)
+
+def save_state(state: Dict[str, Any]) -> None:
+    with open(CHECKPOINTPATH + '.tmp', 'w') as f:
+        json.dump(state, f)
+
+    os.replace(CHECKPOINTPATH + '.tmp', CHECKPOINTPATH)
+
+def report(state: Dict[str, Any], shard: int, account: str, kind: str, ref: str, expected: int, actual: int) -> None:
+    state['discrepancies'] += 1
+    print(f'shard {shard} {account}: {kind} {ref} expected {aw.from_units(expected):f} but ledger has {aw.from_units(actual):f}')
+
+# per account: balance against the ledger, every notified deposit against
+# its deposit/reorg ledger rows (an orphaned deposit keeps the reorg_debt
+# that could not be taken back), every withdrawal against its withdrawal and
+# refund rows. Rows moved to the archive by retention, and rows from before
+# the ledger existed (since), are not checked.
+@aw.read_sql_decorator
+def check_accounts(cursor: sqlite3.Cursor, rowid: int, limit: int, since: int) -> Tuple[int, List[Tuple], Dict[str, int]]:
+    cursor.execute('select rowid, account, balance from account_wallet where rowid > ? order by rowid limit ?', (rowid, limit))
+    accounts = cursor.fetchall()
+
+    if len(accounts) == 0:
+        return (rowid, [], {})
+
+    names = [account for rowid, account, balance in accounts]
+    marks = ', '.join('?' * len(names))
+    problems = []
+
+    cursor.execute(f'select account, sum(delta) from ledger where account in ({marks}) group by account', names)
+    ledger = dict(cursor.fetchall())
+
+    for rowid, account, balance in accounts:
+        if balance != ledger.get(account, 0):
+            problems.append((account, 'balance', '', balance, ledger.get(account, 0)))
+
+    cursor.execute(f'select account, ref, sum(delta) from ledger where account in ({marks}) and kind in (\'deposit\', \'reorg\') group by account, ref', names)
+    credited = {(account, ref): delta for account, ref, delta in cursor}
+
+    cursor.execute(f'select account, txid, sum(case when confirmed == 1 then value else reorg_debt end) from notified_tx where account in ({marks}) and time >= ? group by account, txid', names + [since])
+
+    for account, txid, value in cursor.fetchall():
+        if value != credited.get((account, txid), 0):
+            problems.append((account, 'deposit', txid, value, credited.get((account, txid), 0)))
+
+    cursor.execute(f'select account, kind, ref, sum(delta) from ledger where account in ({marks}) and kind in (\'withdrawal\', \'refund\') group by account, kind, ref', names)
+    withdrawn = {(account, kind, ref): delta for account, kind, ref, delta in cursor}
+
+    cursor.execute(f'select id, account, amount, completed from withdrawal_req where account in ({marks}) and time >= ?', names + [since])
+
+    for id, account, amount, completed in cursor.fetchall():
+        if withdrawn.get((account, 'withdrawal', str(id)), 0) != -amount:
+            problems.append((account, 'withdrawal', str(id), -amount, withdrawn.get((account, 'withdrawal', str(id)), 0)))
+
+        refund = amount if completed == -1 else 0
+
+        if withdrawn.get((account, 'refund', str(id)), 0) != refund:
+            problems.append((account, 'refund', str(id), refund, withdrawn.get((account, 'refund', str(id)), 0)))
+
+    cursor.execute(f'select coalesce(sum(amount), 0) from withdrawal_req where account in ({marks}) and completed in (0, 2)', names)
+    withdrawals = cursor.fetchone()[0]
+
+    cursor.execute(f'select coalesce(sum(amount), 0) from transfer_out where account in ({marks}) and state == 0', names)
+    transfers = cursor.fetchone()[0]
+
+    totals = {'balances': sum(balance for rowid, account, balance in accounts), 'withdrawals': withdrawals, 'transfers': transfers, 'accounts': len(accounts)}
+
+    return (accounts[-1][0], problems, totals)
+
+@aw.read_sql_decorator
+def credited_deposits(cursor: sqlite3.Cursor, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    credited = {}
+
+    for account, txid in keys:
+        cursor.execute('select coalesce(sum(delta), 0) from ledger where account == ? and ref == ? and kind in (\'deposit\', \'reorg\')', (account, txid))
+        credited[(account, txid)] = cursor.fetchone()[0]
+
+    return credited
+
+# balances from before the ledger were carried over as one 'migrate' row
+@aw.read_sql_decorator
+def ledger_start(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('select coalesce(max(time), 0) from ledger where kind == \'migrate\'')
+
+    return cursor.fetchone()[0]
+
+@aw.read_sql_decorator
+def address_accounts(cursor: sqlite3.Cursor, addresses: List[str]) -> Dict[str, str]:
+    accounts = {}
+
+    for i in range(0, len(addresses), CHUNK):
+        chunk = addresses[i:i + CHUNK]
+        cursor.execute(f'select address, account from account_address where address in ({", ".join("?" * len(chunk))})', chunk)
+        accounts.update(cursor.fetchall())
+
+    return accounts
+
+# confirmed receives to one of our addresses that the ledger never credited.
+# Only the addresses in transactions are looked up, and an entry seen twice
+# because the node's list moved between batches counts once.
+def check_transactions(state: Dict[str, Any], transactions: List[Dict], since: int) -> None:
+    receives = {(tx['txid'], tx.get('address'), tx.get('vout')): tx for tx in transactions if tx.get('category') == 'receive' and tx.get('confirmations', 0) >= MINCONF and tx.get('time', 0) >= since}
+    addresses = list({tx.get('address') for tx in receives.values()})
+    accounts = {}
+    values = {}
+
+    for shard in range(aw.WALLETSHARDS):
+        accounts.update(address_accounts(shard, addresses))
+
+    for tx in receives.values():
+        account = accounts.get(tx.get('address'))
+
+        if account is None:
+            continue
+
+        values[(account, tx['txid'])] = values.get((account, tx['txid']), 0) + aw.to_units(tx['amount'])
+
+    for shard in {aw.shard_of(account) for account, txid in values}:
+        keys = [key for key in values if aw.shard_of(key[0]) == shard]
+
+        for (account, txid), credited in credited_deposits(shard, keys).items():
+            if credited != values[(account, txid)]:
+                report(state, shard, account, 'node deposit', txid, values[(account, txid)], credited)
+
+def run(budget: Optional[float] = None) -> Dict[str, Any]:
+    state = load_state()
+    deadline = time.time() + budget if budget is not None else None
+    since = max(ledger_start(shard) for shard in range(aw.WALLETSHARDS))
+
+    while state['phase'] == 'accounts':
+        if deadline is not None and time.time() > deadline:
+            save_state(state)
+            return state
+
+        if state['shard'] >= aw.WALLETSHARDS:
+            state['phase'] = 'transactions'
+            break
+
+        rowid, problems, totals = check_accounts(state['shard'], state['rowid'], CHUNK, since)
+
+        for account, kind, ref, expected, actual in problems:
+            report(state, state['shard'], account, kind, ref, expected, actual)
+
+        for key, value in totals.items():
+            state[key] += value
+
+        if len(totals) == 0:
+            state['shard'] += 1
+            state['rowid'] = 0
+
+        else:
+            state['rowid'] = rowid
+
+        save_state(state)
+
+    while state['phase'] == 'transactions':
+        if deadline is not None and time.time() > deadline:
+            save_state(state)
+            return state
+
+        calls = [('listtransactions', ('*', PAGESIZE, state['skip'] + i * PAGESIZE)) for i in range(PAGESPERBATCH)]
+        pages = coinrpc.call_batch(calls)
+        transactions = state['carry']
+
+        for result, error in pages:
+            if error is not None:
+                raise RuntimeError(f'listtransactions failed: {error}')
+
+            transactions = transactions + result
+            state['transactions'] += len(result)
+
+        state['skip'] += PAGESIZE * PAGESPERBATCH
+
+        if any(len(result) < PAGESIZE for result, error in pages):
+            state['phase'] = 'totals'
+            state['carry'] = []
+
+        else:
+            # each page lists oldest first, so the oldest entry of the batch
+            # may belong to a transaction that goes on in the next batch
+            txid = pages[-1][0][0].get('txid')
+            state['carry'] = [tx for tx in transactions if tx.get('txid') == txid]
+            transactions = [tx for tx in transactions if tx.get('txid') != txid]
+
+        check_transactions(state, transactions, since)
+        save_state(state)
+
+    balances = coinrpc.call_batch([('getbalance', ('*', MINCONF)), ('getbalance', ('*', 0))])
+
+    for result, error in balances:
+        if error is not None:
+            raise RuntimeError(f'getbalance failed: {error}')
+
+    state['node_balance'] = aw.to_units(balances[0][0])
+    state['node_unconfirmed'] = aw.to_units(balances[1][0]) - state['node_balance']
+    state['phase'] = 'done'
+
+    os.remove(CHECKPOINTPATH)
+
+    return state
+
+def main() -> None:
+    aw.init_db()
+
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    state = run(budget)
+
+    if state['phase'] != 'done':
+        print(f'checkpointed in {state["phase"]} after {state["accounts"]} accounts and {state["transactions"]} transactions, run again to continue')
+        return
+
+    owed = state['balances'] + state['withdrawals'] + state['transfers']
+
+    print(f'{state["accounts"]} accounts and {state["transactions"]} node transactions checked, {state["discrepancies"]} discrepancies')
+    print(f'balances {aw.from_units(state["balances"]):f} + pending withdrawals {aw.from_units(state["withdrawals"]):f} + transfers in flight {aw.from_units(state["transfers"]):f} = {aw.from_units(owed):f}KOTO')
+    print(f'node balance {aw.from_units(state["node_balance"]):f}KOTO (+{aw.from_units(state["node_unconfirmed"]):f}KOTO unconfirmed), difference {aw.from_units(state["node_balance"] - owed):f}KOTO')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+from typing import Dict, List, Tuple
+import sqlite3
+import sys
+import time
+import accountwallet as aw
+from config import WALLETARCHIVEPATH
+
+# settled rows older than RETENTIONAGE are copied to the archive database
+# and deleted from the shards RETENTIONBATCH rows per transaction
+RETENTIONAGE = 60 * 60 * 24 * 30
+RETENTIONBATCH = 500
+VACUUMPAGES = 256
+
+# table, columns, which rows are settled
+TABLES = [
+    ('notified_tx', ['txid', 'time', 'confirmed', 'account', 'value', 'blockhash'], 'reorg_debt == 0 and time < ?'),
+    ('withdrawal_req', ['account', 'address', 'amount', 'completed', 'time', 'batch', 'txid'], 'completed in (1, -1) and time < ?'),
+    ('transfer_out', ['id', 'account', 'to_account', 'amount', 'state', 'time'], 'state == 1 and time < ?'),
+    ('transfer_in', ['id', 'account', 'from_account', 'amount', 'time'], 'time < ?'),
+    ('operation', ['ref', 'account', 'amount', 'time'], 'time < ?'),
+]
+
+def open_archive() -> sqlite3.Connection:
+    conn = sqlite3.connect(WALLETARCHIVEPATH)
+
+    for table, columns, condition in TABLES:
+        conn.execute(f'create table if not exists {table}(shard integer not null, source_rowid integer not null, {", ".join(columns)}, archived integer not null)')
+        conn.execute(f'create index if not exists {table}_source on {table}(shard, source_rowid)')
+
+    conn.commit()
+
+    return conn
+
+@aw.read_sql_decorator
+def settled_rows(cursor: sqlite3.Cursor, table: str, columns: List[str], condition: str, before: int, rowid: int, limit: int) -> List[Tuple]:
+    cursor.execute(f'select rowid, {", ".join(columns)} from {table} where rowid > ? and {condition} order by rowid limit ?', (rowid, before, limit))
+
+    return cursor.fetchall()
+
+# a deposit's txid stays behind in archived_tx, notify_tx needs it to skip
+# a deposit it has already credited
+@aw.sql_decorator
+def delete_rows(cursor: sqlite3.Cursor, table: str, rowids: List[int]) -> None:
+    if table == 'notified_tx':
+        cursor.executemany('insert into archived_tx(txid, account, time) select txid, account, time from notified_tx where rowid == ?', [(rowid,) for rowid in rowids])
+
+    cursor.executemany(f'delete from {table} where rowid == ?', [(rowid,) for rowid in rowids])
+
+# the archive is committed before the rows are deleted, so a crash in
+# between leaves duplicates in the archive (same shard and source_rowid)
+# rather than losing rows
+def archive_table(shard: int, archive: sqlite3.Connection, table: str, columns: List[str], condition: str, before: int) -> int:
+    insert = f'insert into {table}(shard, source_rowid, {", ".join(columns)}, archived) values({", ".join("?" * (len(columns) + 3))})'
+    rowid = 0
+    count = 0
+
+    while True:
+        rows = settled_rows(shard, table, columns, condition, before, rowid, RETENTIONBATCH)
+
+        if len(rows) == 0:
+            return count
+
+        archive.executemany(insert, [(shard,) + row + (int(time.time()),) for row in rows])
+        archive.commit()
+
+        delete_rows(shard, table, [row[0] for row in rows])
+
+        rowid = rows[-1][0]
+        count = count + len(rows)
+
+def pages(shard: int) -> Tuple[int, int, int]:
+    conn = aw.connection(shard)
+
+    return tuple(conn.execute(f'pragma {pragma}').fetchone()[0] for pragma in ('page_size', 'page_count', 'freelist_count'))
+
+@aw.sql_decorator
+def vacuum_step(cursor: sqlite3.Cursor, count: int) -> None:
+    cursor.execute(f'pragma incremental_vacuum({count})')
+    cursor.fetchall()
+
+# incremental vacuum only works once auto_vacuum is INCREMENTAL, which
+# needs one full VACUUM with the bot stopped (enable_vacuum)
+def vacuum(shard: int) -> None:
+    if aw.connection(shard).execute('pragma auto_vacuum').fetchone()[0] != 2:
+        return
+
+    while pages(shard)[2] > 0:
+        vacuum_step(shard, VACUUMPAGES)
+
+def enable_vacuum() -> None:
+    for shard in range(aw.WALLETSHARDS):
+        conn = aw.connection(shard)
+
+        if conn.execute('pragma auto_vacuum').fetchone()[0] == 2:
+            continue
+
+        conn.execute('pragma auto_vacuum = INCREMENTAL')
+        conn.execute('vacuum')
+
+def run(age: int = RETENTIONAGE) -> Dict[str, int]:
+    report = {table: 0 for table, columns, condition in TABLES}
+    report['bytes'] = 0
+    archive = open_archive()
+
+    try:
+        for shard in range(aw.WALLETSHARDS):
+            page_size, page_count, freelist_count = pages(shard)
+
+            for table, columns, condition in TABLES:
+                report[table] += archive_table(shard, archive, table, columns, condition, int(time.time()) - age)
+
+            vacuum(shard)
+
+            report['bytes'] += (page_count - pages(shard)[1]) * page_size
+
+    finally:
+        archive.close()
+
+    return report
+
+def main() -> None:
+    aw.init_db()
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'enable_vacuum':
+        enable_vacuum()
+        return
+
+    age = int(float(sys.argv[1]) * 60 * 60 * 24) if len(sys.argv) > 1 else RETENTIONAGE
+    report = run(age)
+
+    for table, columns, condition in TABLES:
+        print(f'{table}: {report[table]} rows archived')
+
+    print(f'{report["bytes"]} bytes reclaimed')
+
+    for shard in range(aw.WALLETSHARDS):
+        page_size, page_count, freelist_count = pages(shard)
+
+        if freelist_count > 0:
+            print(f'shard {shard}: {freelist_count * page_size} bytes free but not returned, run enable_vacuum with the bot stopped')
+
+
+if __name__ == '__main__':
+    main()
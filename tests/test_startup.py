@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CONFIG = '''
+CONSUMERKEY = 'key'
+CONSUMERSECRET = 'secret'
+ACCESSTOKEN = 'token'
+ACCESSTOKENSECRET = 'token secret'
+BOTSCREENNAME = 'tipkotone'
+RPCUSER = 'user'
+RPCPASSWORD = 'password'
+RPCPORT = 1
+MINCONF = 6
+WORKERS = 1
+QUEUESIZE = 100
+WALLETSHARDS = 1
+WALLETDBPATH = {directory!r} + '/wallet.db'
+WALLETARCHIVEPATH = {directory!r} + '/archive.db'
+EVENTDBPATH = {directory!r} + '/event.db'
+USERCACHEPATH = None
+WALLETDSOCKET = {directory!r} + '/walletd.sock'
+METRICSDIR = None
+'''
+
+# the budget is loose so a slow machine doesn't fail it; what must hold
+# everywhere is that no client library is imported and no database opened
+def test_startup(tmp_path):
+    with open(tmp_path / 'config.py', 'w') as f:
+        f.write(CONFIG.format(directory = str(tmp_path)))
+
+    env = dict(os.environ, PYTHONPATH = str(tmp_path))
+    process = subprocess.run([sys.executable, os.path.join(ROOT, 'bench', 'startup.py'), '2000', '3'], cwd = tmp_path, env = env, capture_output = True, text = True)
+
+    assert process.returncode == 0, process.stdout + process.stderr
+    assert set(os.listdir(tmp_path)) <= {'config.py', '__pycache__'}
@@ -1,4 +1,4 @@
-from typing import Dict, Optional
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 import accountwallet as aw
 import re
 import twitter
@@ -7,36 +7,92 @@ import random
 import string
 from decimal import Decimal
 import coinrpc
+import metrics
+import outbox
+import time
 
-def get_command(text: str) -> Dict:
-    text = re.sub(' +', ' ', re.sub('(\n+| +|　+)', ' ', text))
-    words = text.split(' ')
+RAINMAX = 50
 
-    while f'@{BOTSCREENNAME}' in words:
-        words = words[words.index(f'@{BOTSCREENNAME}') + 1:]
+class Command(NamedTuple):
+    method: Optional[str]
+    params: Tuple[str, ...] = ()
 
-        if len(words) == 0:
+# keyword -> method, matched against the lowercased word after the mention
+KEYWORDS = {
+    'tip': 'tip', '投げ銭': 'tip', '投銭': 'tip', 'send': 'tip', '送金': 'tip',
+    'balance': 'balance',
+    'deposit': 'deposit',
+    'withdraw': 'withdraw', '出金': 'withdraw',
+    'help': 'help', 'ヘルプ': 'help',
+}
+# two letter prefix -> method, e.g. 残高確認
+PREFIXES = {'残高': 'balance', '入金': 'deposit'}
+# matched against the following words joined together, e.g. 'follow me'
+FOLLOWS = ('followme', 'フォローミー', 'フォローして')
+FOLLOWLENGTH = max(len(follow) for follow in FOLLOWS)
+TAKESPARAMS = {'tip', 'withdraw'}
+
+RETWEET = re.compile('^(RT|QT) | (RT|QT) ')
+
+def parse_command(words: List[str], i: int) -> Optional[Command]:
+    word = words[i].lower()
+    method = KEYWORDS.get(word) or PREFIXES.get(word[:2])
+
+    if method in TAKESPARAMS:
+        return Command(method, tuple(words[i + 1:]))
+
+    if method is not None:
+        return Command(method)
+
+    joined = ''
+
+    for word in words[i:]:
+        joined = joined + word.lower()
+
+        if len(joined) >= FOLLOWLENGTH:
             break
 
-        if re.match('^(tip|投げ銭|投銭|send|送金)$', words[0].lower()):
-            return {'method': 'tip', 'params': words[1:]}
+    if joined.startswith(FOLLOWS):
+        return Command('follow')
 
-        if re.match('^(balance|残高.*)$', words[0].lower()):
-            return {'method': 'balance'}
+    return None
 
-        if re.match('^(deposit|入金.*)$', words[0].lower()):
-            return {'method': 'deposit'}
+def get_command(text: str) -> Command:
+    words = text.split()
+    mention = f'@{BOTSCREENNAME}'
 
-        if re.match('^(withdraw|出金)$', words[0].lower()):
-            return {'method': 'withdraw', 'params': words[1:]}
+    for i, word in enumerate(words[:-1]):
+        if word != mention:
+            continue
 
-        if re.match('^(help|ヘルプ)$', words[0].lower()):
-            return {'method': 'help'}
+        command = parse_command(words, i + 1)
 
-        if re.match('^(followme|フォローミー|フォローして)', ''.join([word.lower() for word in words])):
-            return {'method': 'follow'}
+        if command is not None:
+            return command
 
-    return {'method': None}
+    return Command(None)
+
+# the bot's own tweets and DMs and retweets are never commands
+def ignored(data: Dict) -> bool:
+    for event in data.get('tweet_create_events', []):
+        if event['user']['screen_name'] == BOTSCREENNAME or RETWEET.search(event['text']):
+            return True
+
+    for event in data.get('direct_message_events', []):
+        if data['users'][event['message_create']['sender_id']]['screen_name'] == BOTSCREENNAME:
+            return True
+
+    return False
+
+# the command a single event payload would run, without running it
+def classify(data: Dict) -> Optional[str]:
+    for event in data.get('tweet_create_events', []):
+        return get_command(event['text']).method
+
+    for event in data.get('direct_message_events', []):
+        return get_command(f'@{BOTSCREENNAME} ' + event['message_create']['message_data']['text']).method
+
+    return None
 
 def get_message(text: str, *screen_names: str) -> str:
     for screen_name in screen_names[::-1]:
@@ -62,33 +118,121 @@ def Decimal_to_str(d: Decimal) -> str:
 
     return return_s
 
-def execute(text: str, user_id: str, screen_name: str, name: str, from_tweet: bool) -> Optional[str]:
-    account = 'twitter-' + user_id
-    name = name.split('@')[0] if not name.startswith('@') else name
+# the leading @names without case-insensitive duplicates, and how many words they took
+def get_screen_names(words: Sequence[str]) -> Tuple[List[str], int]:
+    screen_names = []
+    count = 0
+
+    for word in words:
+        if not word.startswith('@'):
+            break
+
+        count = count + 1
+
+        if word[1:].lower() not in [screen_name.lower() for screen_name in screen_names]:
+            screen_names.append(word[1:])
+
+    return (screen_names, count)
+
+def rain(account: str, screen_name: str, name: str, to_screen_names: List[str], str_amount: str, from_tweet: bool, ref: Optional[str] = None) -> str:
+    if len(to_screen_names) > RAINMAX:
+        text = f'一度に投げ銭できるのは{RAINMAX}人までです・・・'
+
+        return get_message(text, screen_name) if from_tweet else get_message(text)
+
+    if screen_name.lower() in [to_screen_name.lower() for to_screen_name in to_screen_names]:
+        text = '自身には投げ銭できません・・・'
+
+        return get_message(text, screen_name) if from_tweet else get_message(text)
+
+    to_users = twitter.users([to_screen_name for to_screen_name in to_screen_names if to_screen_name != BOTSCREENNAME])
+    to_accounts = []
+
+    for to_screen_name in to_screen_names:
+        if to_screen_name == BOTSCREENNAME:
+            to_accounts.append('FREE')
+            continue
+
+        to_user = to_users[to_screen_name.lower()]
+
+        if to_user.get('error') is not None:
+            text = f'宛先 @{to_screen_name} が見つかりませんでした・・・'
+
+            return get_message(text, screen_name) if from_tweet else get_message(text)
+
+        to_accounts.append('twitter-' + to_user['id_str'])
+
+    result = aw.move_many(account, to_accounts, str_amount, ref)
+
+    if result == 'self':
+        text = '自身には投げ銭できません・・・'
+
+        return get_message(text, screen_name) if from_tweet else get_message(text)
+
+    elif result == 'wrong':
+        text = '不正な金額です・・・'
+
+        return get_message(text, screen_name) if from_tweet else get_message(text)
+
+    elif result == 'few':
+        text = '金額が小さすぎです・・・'
+
+        return get_message(text, screen_name) if from_tweet else get_message(text)
+
+    elif result == 'insufficient':
+        text = '残高が足りません・・・'
+
+        return get_message(text, screen_name) if from_tweet else get_message(text)
+
+    amount = Decimal_to_str(result)
+    text = f'{name}さんから {len(to_accounts)}人へ お心付けです！ 各{amount}KOTO'
+
+    return get_message(text, screen_name) if from_tweet else get_message(text)
+
+# ref is the id of the event the command came in, so the wallet can tell a
+# replayed event from a new one
+def execute(text: str, user_id: str, screen_name: str, name: str, from_tweet: bool, ref: Optional[str] = None) -> Optional[str]:
     command = get_command(text)
 
-    if command['method'] == None:
+    if command.method is None:
         return None
 
-    if command['method'] == 'tip':
-        if len(command['params']) < 2:
+    start = time.perf_counter()
+
+    try:
+        return run_command(command, user_id, screen_name, name, from_tweet, ref)
+
+    finally:
+        metrics.observe('tipbot_execute_seconds', time.perf_counter() - start, command = command.method)
+
+def run_command(command: Command, user_id: str, screen_name: str, name: str, from_tweet: bool, ref: Optional[str] = None) -> Optional[str]:
+    account = 'twitter-' + user_id
+    name = name.split('@')[0] if not name.startswith('@') else name
+
+    if command.method == 'tip':
+        if len(command.params) < 2:
             text = 'tipkotoneの使い方をご確認ください！ https://github.com/akarinS/tipkotone/blob/master/README.md'
 
             return get_message(text, screen_name) if from_tweet else get_message(text)
 
-        if re.match('^@', command['params'][0]):
-            to_screen_name = command['params'][0][1:]
-            str_amount = command['params'][1]
+        if command.params[0].startswith('@'):
+            to_screen_names, count = get_screen_names(command.params)
+            str_amount = command.params[count] if len(command.params) > count else ''
 
-        elif re.match('^@', command['params'][1]):
-            to_screen_name = command['params'][1][1:]
-            str_amount = command['params'][0]
+        elif command.params[1].startswith('@'):
+            to_screen_names, count = get_screen_names(command.params[1:])
+            str_amount = command.params[0]
 
         else:
             text = '宛先が間違っています・・・'
 
             return get_message(text, screen_name) if from_tweet else get_message(text)
 
+        if len(to_screen_names) > 1:
+            return rain(account, screen_name, name, to_screen_names, str_amount, from_tweet, ref)
+
+        to_screen_name = to_screen_names[0]
+
         if to_screen_name == screen_name:
             text = '自身には投げ銭できません・・・'
 
@@ -110,7 +254,7 @@ def execute(text: str, user_id: str, screen_name: str, name: str, from_tweet: bo
             to_name = to_user['name']
             to_name = to_name.split('@')[0] if not to_name.startswith('@') else name
 
-        result = aw.move(account, to_account, str_amount)
+        result = aw.move(account, to_account, str_amount, ref)
 
         if result == 'wrong':
             text = '不正な金額です・・・'
@@ -138,7 +282,7 @@ def execute(text: str, user_id: str, screen_name: str, name: str, from_tweet: bo
 
         return get_message(text, screen_name, to_screen_name) if from_tweet else get_message(text)
 
-    if command['method'] == 'balance':
+    if command.method == 'balance':
         balance, confirming_balance = aw.get_account_balance(account)
 
         balance = Decimal_to_str(balance)
@@ -152,26 +296,26 @@ def execute(text: str, user_id: str, screen_name: str, name: str, from_tweet: bo
 
         return get_message(text, screen_name) if from_tweet else get_message(text)
 
-    if command['method'] == 'deposit':
+    if command.method == 'deposit':
         address = aw.get_account_address(account)
 
         text = f'{address} に送金してください！'
 
         return get_message(text, screen_name) if from_tweet else get_message(text)
 
-    if command['method'] == 'withdraw':
-        if len(command['params']) < 2:
+    if command.method == 'withdraw':
+        if len(command.params) < 2:
             text = 'tipkotoneの使い方をご確認ください！ https://github.com/akarinS/tipkotone/blob/master/README.md'
 
             return get_message(text, screen_name) if from_tweet else get_message(text)
 
-        if re.match('^(k|jz)', command['params'][0]):
-            address = command['params'][0]
-            str_amount = command['params'][1]
+        if command.params[0].startswith(('k', 'jz')):
+            address = command.params[0]
+            str_amount = command.params[1]
 
-        elif re.match('^(k|jz)', command['params'][1]):
-            address = command['params'][1]
-            str_amount = command['params'][0]
+        elif command.params[1].startswith(('k', 'jz')):
+            address = command.params[1]
+            str_amount = command.params[0]
 
         else:
             text = 'アドレスが間違っています・・・'
@@ -183,7 +327,7 @@ def execute(text: str, user_id: str, screen_name: str, name: str, from_tweet: bo
 
             return get_message(text, screen_name) if from_tweet else get_message(text)
 
-        result = aw.add_withdrawal_request(account, address, str_amount)
+        result = aw.add_withdrawal_request(account, address, str_amount, ref)
 
         if result == 'wrong':
             text = '不正な金額です・・・'
@@ -205,12 +349,12 @@ def execute(text: str, user_id: str, screen_name: str, name: str, from_tweet: bo
 
         return get_message(text, screen_name) if from_tweet else get_message(text)
 
-    if command['method'] == 'help':
+    if command.method == 'help':
         text = 'tipkotoneの使い方はこちらです！ https://github.com/akarinS/tipkotone/blob/master/README.md'
 
         return get_message(text, screen_name) if from_tweet else get_message(text)
 
-    if command['method'] == 'follow':
+    if command.method == 'follow':
         twitter.follow(user_id)
         text = 'フォローしました！'
 
@@ -230,17 +374,17 @@ def main(data: Dict) -> None:
             if screen_name == BOTSCREENNAME:
                 continue
 
-            if re.match('(^RT |^QT |.* RT |.* QT ).*', text):
+            if RETWEET.search(text):
                 continue
 
-            message = execute(text, user_id, screen_name, name, True)
+            message = execute(text, user_id, screen_name, name, True, 'tweet-' + status_id)
 
             if message is not None:
-                twitter.tweet(message[:140], status_id)
+                outbox.push('tweet', message[:140], status_id)
 
     if 'direct_message_events' in data:
         for event in [event for event in data['direct_message_events'] if event['type'] == 'message_create']:
-            text = '@tipkotone ' + event['message_create']['message_data']['text']
+            text = f'@{BOTSCREENNAME} ' + event['message_create']['message_data']['text']
             user_id = event['message_create']['sender_id']
             screen_name = data['users'][user_id]['screen_name']
             name = data['users'][user_id]['name']
@@ -248,8 +392,22 @@ def main(data: Dict) -> None:
             if screen_name == BOTSCREENNAME:
                 continue
 
-            message = execute(text, user_id, screen_name, name, False)
+            message = execute(text, user_id, screen_name, name, False, 'dm-' + event['id'])
 
             if message is not None:
-                twitter.dm(message, user_id)
+                outbox.push('dm', message, user_id)
+
+
+# the reply to an event that failed every attempt, so the sender isn't left waiting
+def apologize(data: Dict) -> None:
+    text = 'エラーが発生しました・・・ 時間をおいてもう一度お試しください'
+
+    for event in data.get('tweet_create_events', []):
+        if event['user']['screen_name'] != BOTSCREENNAME:
+            outbox.push('tweet', get_message(text, event['user']['screen_name']), event['id_str'])
+
+    for event in [event for event in data.get('direct_message_events', []) if event['type'] == 'message_create']:
+        user_id = event['message_create']['sender_id']
 
+        if data['users'][user_id]['screen_name'] != BOTSCREENNAME:
+            outbox.push('dm', get_message(text), user_id)
@@ -1,34 +1,210 @@
-from typing import Dict
-from requests_oauthlib import OAuth1Session
-from config import CONSUMERKEY, CONSUMERSECRET, ACCESSTOKEN, ACCESSTOKENSECRET
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from collections import OrderedDict
+import json
+import sqlite3
+import threading
+import time
+import metrics
+from config import CONSUMERKEY, CONSUMERSECRET, ACCESSTOKEN, ACCESSTOKENSECRET, USERCACHEPATH
 
-def tweet(status: str, in_reply_to_status_id: str) -> None:
-    api = OAuth1Session(CONSUMERKEY, CONSUMERSECRET, ACCESSTOKEN, ACCESSTOKENSECRET)
-    url = 'https://api.twitter.com/1.1/statuses/update.json'
+API = 'https://api.twitter.com/1.1'
+CACHESIZE = 10000
+CACHETTL = 60 * 60
+NEGATIVECACHETTL = 60 * 5
+
+if TYPE_CHECKING:
+    import requests
+    import requests_oauthlib
+
+# requests_oauthlib is only imported by the first request, so events that
+# never reach Twitter don't pay for it
+api = None
+api_lock = threading.Lock()
+
+cache = OrderedDict()
+cache_lock = threading.Lock()
+cache_stats = {'hits': 0, 'misses': 0}
+
+# endpoint -> (x-rate-limit-remaining, x-rate-limit-reset)
+rate_limits = {}
+
+local = threading.local()
+
+def get_api() -> 'requests_oauthlib.OAuth1Session':
+    global api
+
+    with api_lock:
+        if api is None:
+            from requests_oauthlib import OAuth1Session
+
+            api = OAuth1Session(CONSUMERKEY, CONSUMERSECRET, ACCESSTOKEN, ACCESSTOKENSECRET)
+
+    return api
+
+def track(endpoint: str, response: 'requests.Response') -> 'requests.Response':
+    remaining = response.headers.get('x-rate-limit-remaining')
+    reset = response.headers.get('x-rate-limit-reset')
+
+    if remaining is not None and reset is not None:
+        rate_limits[endpoint] = (int(remaining), int(reset))
+
+    elif response.status_code == 429:
+        rate_limits[endpoint] = (0, int(time.time()) + 60)
+
+    return response
+
+def request(method: str, endpoint: str, **kwargs: Any) -> 'requests.Response':
+    start = time.perf_counter()
+
+    try:
+        response = get_api().request(method, f'{API}/{endpoint}.json', **kwargs)
+
+    finally:
+        metrics.observe('twitter_request_seconds', time.perf_counter() - start, endpoint = endpoint)
+
+    return track(endpoint, response)
+
+def wait_time(endpoint: str) -> float:
+    remaining, reset = rate_limits.get(endpoint, (1, 0))
+
+    if remaining > 0:
+        return 0
+
+    return max(0, reset - time.time())
+
+def tweet(status: str, in_reply_to_status_id: str) -> 'requests.Response':
     params = {'status': status, 'in_reply_to_status_id': in_reply_to_status_id}
 
-    api.post(url, params = params)
+    return request('POST', 'statuses/update', params = params)
 
-def dm(text: str, recipient_id: str) -> None:
-    api = OAuth1Session(CONSUMERKEY, CONSUMERSECRET, ACCESSTOKEN, ACCESSTOKENSECRET)
-    url = 'https://api.twitter.com/1.1/direct_messages/events/new.json'
+def dm(text: str, recipient_id: str) -> 'requests.Response':
     params = {'event': {'type': 'message_create', 'message_create': {'target': {'recipient_id': recipient_id}, 'message_data': {'text': text}}}}
 
-    api.post(url, json = params)
+    return request('POST', 'direct_messages/events/new', json = params)
+
+def cache_db() -> Optional[sqlite3.Connection]:
+    if USERCACHEPATH is None:
+        return None
+
+    conn = getattr(local, 'conn', None)
+
+    if conn is None:
+        conn = sqlite3.connect(USERCACHEPATH, timeout = 60, isolation_level = None)
+        conn.execute('pragma journal_mode = WAL')
+        conn.execute('create table if not exists user_cache(screen_name text primary key, user text not null, expires integer not null)')
+        local.conn = conn
+
+    return conn
+
+def cache_get(key: str) -> Optional[Dict]:
+    with cache_lock:
+        entry = cache.get(key)
+
+        if entry is not None and entry[0] > time.time():
+            cache.move_to_end(key)
+            return entry[1]
+
+    conn = cache_db()
+
+    if conn is None:
+        return None
+
+    row = conn.execute('select user, expires from user_cache where screen_name == ? and expires > ?', (key, int(time.time()))).fetchone()
+
+    if row is None:
+        return None
+
+    user = json.loads(row[0])
+    cache_put(key, user, row[1], False)
+
+    return user
+
+def cache_put(key: str, user: Dict, expires: float, persist: bool = True) -> None:
+    with cache_lock:
+        cache[key] = (expires, user)
+        cache.move_to_end(key)
+
+        while len(cache) > CACHESIZE:
+            cache.popitem(last = False)
+
+    conn = cache_db()
+
+    if conn is not None and persist:
+        conn.execute('insert or replace into user_cache(screen_name, user, expires) values(?, ?, ?)', (key, json.dumps(user), int(expires)))
 
 def user(screen_name: str) -> Dict:
-    api = OAuth1Session(CONSUMERKEY, CONSUMERSECRET, ACCESSTOKEN, ACCESSTOKENSECRET)
-    url = 'https://api.twitter.com/1.1/users/show.json'
+    key = screen_name.lower()
+    cached = cache_get(key)
+
+    with cache_lock:
+        cache_stats['hits' if cached is not None else 'misses'] += 1
+
+    metrics.inc('twitter_user_cache_total', result = 'hit' if cached is not None else 'miss')
+
+    if cached is not None:
+        return cached
+
     params = {'screen_name': screen_name}
 
-    response = api.get(url, params = params)
+    response = request('GET', 'users/show', params = params).json()
+
+    if 'errors' in response:
+        result = {'error': response['errors']}
+
+        if {error.get('code') for error in response['errors']} & {50, 63}:
+            cache_put(key, result, time.time() + NEGATIVECACHETTL)
+
+        return result
+
+    result = {'id_str': response['id_str'], 'name': response['name']}
+    cache_put(key, result, time.time() + CACHETTL)
 
-    return response.json()
+    return result
+
+def users(screen_names: List[str]) -> Dict[str, Dict]:
+    results = {}
+    keys = []
+
+    for screen_name in screen_names:
+        key = screen_name.lower()
+        cached = cache_get(key)
+
+        with cache_lock:
+            cache_stats['hits' if cached is not None else 'misses'] += 1
+
+        metrics.inc('twitter_user_cache_total', result = 'hit' if cached is not None else 'miss')
+
+        if cached is not None:
+            results[key] = cached
+
+        elif key not in keys:
+            keys.append(key)
+
+    for i in range(0, len(keys), 100):
+        response = request('POST', 'users/lookup', data = {'screen_name': ','.join(keys[i:i + 100])}).json()
+
+        if 'errors' in response:
+            if {error.get('code') for error in response['errors']} != {17}:
+                for key in keys[i:i + 100]:
+                    results[key] = {'error': response['errors']}
+
+                continue
+
+            response = []
+
+        for r in response:
+            key = r['screen_name'].lower()
+            results[key] = {'id_str': r['id_str'], 'name': r['name']}
+            cache_put(key, results[key], time.time() + CACHETTL)
+
+        for key in keys[i:i + 100]:
+            if key not in results:
+                results[key] = {'error': 'not found'}
+                cache_put(key, results[key], time.time() + NEGATIVECACHETTL)
+
+    return results
 
 def follow(user_id: str) -> None:
-    api = OAuth1Session(CONSUMERKEY, CONSUMERSECRET, ACCESSTOKEN, ACCESSTOKENSECRET)
-    url = 'https://api.twitter.com/1.1/friendships/create.json'
     params = {'user_id': user_id, 'follow': 'true'}
 
-    api.post(url, params = params)
-
+    request('POST', 'friendships/create', params = params)
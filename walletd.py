@@ -0,0 +1,91 @@
+from typing import Any, Callable
+import os
+import socket
+import threading
+import time
+import accountwallet as aw
+import retention
+from config import WALLETDSOCKET
+
+CHECKINTERVAL = 60
+WITHDRAWALINTERVAL = 60
+RETENTIONINTERVAL = 60 * 60 * 24
+
+arrived = threading.Condition()
+txids = set()
+blocks = 0
+
+def receive(sock: socket.socket) -> None:
+    global blocks
+
+    while True:
+        words = sock.recv(1024).decode().split()
+
+        if len(words) < 2:
+            continue
+
+        with arrived:
+            if words[0] == 'tx':
+                txids.add(words[1])
+
+            elif words[0] == 'block':
+                blocks = blocks + 1
+
+            else:
+                continue
+
+            arrived.notify()
+
+def run(task: Callable, *args: Any) -> None:
+    try:
+        task(*args)
+
+    except Exception as err:
+        print('Error:', task.__name__, err)
+
+def main() -> None:
+    global txids, blocks
+
+    aw.init_db()
+
+    if os.path.exists(WALLETDSOCKET):
+        os.remove(WALLETDSOCKET)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(WALLETDSOCKET)
+
+    threading.Thread(target = receive, args = (sock,), daemon = True).start()
+
+    checked = 0
+    withdrawn = 0
+    archived = time.time()
+
+    while True:
+        with arrived:
+            if len(txids) == 0 and blocks == 0:
+                arrived.wait(timeout = min(checked + CHECKINTERVAL, withdrawn + WITHDRAWALINTERVAL, archived + RETENTIONINTERVAL) - time.time())
+
+            notified, txids = txids, set()
+            blocked, blocks = blocks, 0
+
+        # repeated notifies for the same txid or block have been coalesced into one
+        for txid in notified:
+            run(aw.notify_tx, txid)
+
+        if blocked > 0 or time.time() >= checked + CHECKINTERVAL:
+            run(aw.check_tx)
+            run(aw.recover_transfers)
+            run(aw.fill_address_pools)
+            checked = time.time()
+
+        if time.time() >= withdrawn + WITHDRAWALINTERVAL:
+            run(aw.exec_withdrawal)
+            withdrawn = time.time()
+
+        if time.time() >= archived + RETENTIONINTERVAL:
+            run(retention.run)
+            archived = time.time()
+
+
+if __name__ == '__main__':
+    main()
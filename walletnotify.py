@@ -0,0 +1,20 @@
+# Forwards a kotod notification to walletd without loading the wallet.
+#
+#     walletnotify=python3 walletnotify.py tx %s
+#     blocknotify=python3 walletnotify.py block %s
+
+import socket
+import sys
+from config import WALLETDSOCKET
+
+def main() -> None:
+    if len(sys.argv) < 3:
+        print('Argument is missing.')
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.sendto(f'{sys.argv[1]} {sys.argv[2]}'.encode(), WALLETDSOCKET)
+
+
+if __name__ == '__main__':
+    main()
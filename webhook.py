@@ -0,0 +1,166 @@
+from typing import Dict, List, Tuple
+from config import CONSUMERSECRET, QUEUESIZE
+import base64
+import eventqueue
+import hashlib
+import hmac
+import metrics
+import outbox
+import socket
+import threading
+import time
+import tipbot
+
+# what the Flask and aiohttp servers share: signatures, admission and the
+# push into the event queue. The events are run by eventd.
+
+# tip and withdraw move value and go first; everything else is shed once
+# SHEDLEVEL events are pending, and only tip and withdraw get the rest of the queue
+PRIORITIES = {'tip': 0, 'withdraw': 0}
+LOWPRIORITY = 1
+SHEDLEVEL = QUEUESIZE // 2
+
+# every sender gets a token bucket of USERBURST commands, refilled at USERRATE per second
+USERRATE = 0.2
+USERBURST = 5
+BUCKETSMAX = 100000
+
+# eventd listens here and wakes its workers when events were pushed
+EVENTDSOCKET = eventqueue.EVENTDBPATH + '.sock'
+
+admission_lock = threading.Lock()
+# sender -> (tokens, last refill)
+buckets = {}
+shed = {'ignored': 0, 'not_command': 0, 'rate_limited': 0, 'overload': 0}
+
+wake_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+wake_socket.setblocking(False)
+
+# the reply table too, the metrics endpoint reads its depth
+def init() -> None:
+    eventqueue.init_db()
+    outbox.init_db()
+
+def sig(msg: bytes) -> str:
+    sha256_hash_digest = hmac.new(CONSUMERSECRET.encode(), msg = msg, digestmod = hashlib.sha256).digest()
+    return 'sha256=' + base64.b64encode(sha256_hash_digest).decode()
+
+def validate(signature: str, data: bytes) -> bool:
+    return hmac.compare_digest(signature, sig(data))
+
+def crc_response(crc_token: str) -> Dict[str, str]:
+    return {'response_token': sig(crc_token.encode())}
+
+def take_token(sender: str) -> bool:
+    now = time.time()
+
+    with admission_lock:
+        tokens, last = buckets.get(sender, (USERBURST, now))
+        tokens = min(USERBURST, tokens + (now - last) * USERRATE)
+
+        if tokens < 1:
+            buckets[sender] = (tokens, now)
+            return False
+
+        buckets[sender] = (tokens - 1, now)
+
+        if len(buckets) > BUCKETSMAX:
+            # a bucket that has refilled is the same as no bucket
+            for key in [key for key, (tokens, last) in buckets.items() if tokens + (now - last) * USERRATE >= USERBURST]:
+                del buckets[key]
+
+            if len(buckets) > BUCKETSMAX:
+                buckets.clear()
+
+        return True
+
+def count_shed(reason: str, count: int = 1) -> None:
+    if count == 0:
+        return
+
+    with admission_lock:
+        shed[reason] += count
+
+    metrics.inc('webhook_events_total', count, result = reason)
+
+# classification only parses the text, so floods of mentions that aren't
+# commands never reach the queue or a worker. Events already in the queue
+# were redelivered and are neither counted nor charged again.
+def admit(events: List[Tuple[str, str, Dict]]) -> List[Tuple[str, str, Dict, int]]:
+    admitted = []
+
+    if len(events) == 0:
+        return admitted
+
+    known = eventqueue.known([event[0] for event in events])
+
+    for event_id, sender, payload in events:
+        if event_id in known:
+            continue
+
+        if tipbot.ignored(payload):
+            count_shed('ignored')
+            continue
+
+        method = tipbot.classify(payload)
+
+        if method is None:
+            count_shed('not_command')
+            continue
+
+        admitted.append((event_id, sender, payload, PRIORITIES.get(method, LOWPRIORITY)))
+
+    return admitted
+
+# tokens are only taken for events that are going to be pushed
+def charge(admitted: List[Tuple[str, str, Dict, int]]) -> List[Tuple[str, str, Dict, int]]:
+    charged = []
+
+    for event in admitted:
+        if not take_token(event[1]):
+            count_shed('rate_limited')
+            continue
+
+        charged.append(event)
+
+    return charged
+
+# a lost wake-up only delays the events until eventd's next poll
+def wake() -> None:
+    try:
+        wake_socket.sendto(b'event', EVENTDSOCKET)
+
+    except OSError:
+        pass
+
+def accept(data: Dict) -> Tuple[str, int]:
+    admitted = admit(eventqueue.split(data))
+
+    if len(admitted) == 0:
+        return 'OK', 200
+
+    pending = eventqueue.pending()
+
+    if pending >= SHEDLEVEL:
+        count_shed('overload', len([event for event in admitted if event[3] == LOWPRIORITY]))
+        admitted = [event for event in admitted if event[3] != LOWPRIORITY]
+
+        if len(admitted) == 0:
+            return 'OK', 200
+
+    if pending >= QUEUESIZE:
+        metrics.inc('webhook_events_total', len(admitted), result = 'dropped')
+        return 'Busy', 503
+
+    admitted = charge(admitted)
+
+    if len(admitted) == 0:
+        return 'OK', 200
+
+    accepted = eventqueue.push(admitted)
+
+    if accepted > 0:
+        metrics.inc('webhook_events_total', accepted, result = 'accepted')
+        wake()
+
+    return 'OK', 200